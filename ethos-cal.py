@@ -1,93 +1,12 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.lib.enums import TA_CENTER, TA_LEFT
 import io
-from PIL import Image as PILImage
+from ethos_engine import (TITLE_BONUS_RATES, RATE_MATRIX, create_monthly_projection, calculate_profit_sharing,
+                          encode_levels, calculate_rev_share_batch)
 
 # Configure the page
 st.set_page_config(page_title="Ethos Lending Calculator Suite", layout="wide")
 
-# Define your TITLE_BONUS_RATES dictionary here
-TITLE_BONUS_RATES = {
-    'Ambassador (AMB)': {
-        'level1_bonus': 0.0005,
-        'level2_bonus': 0,
-        'level3_bonus': 0,
-        'level1_gen_bonus': 0,
-        'level2_gen_bonus': 0,
-        'level3_gen_bonus': 0,
-        'has_profit_share': False,
-        'profit_share_bonus': 0
-    },
-    'Active Ambassador (AAMB)': {
-        'level1_bonus': 0.001,
-        'level2_bonus': 0,
-        'level3_bonus': 0,
-        'level1_gen_bonus': 0,
-        'level2_gen_bonus': 0,
-        'level3_gen_bonus': 0,
-        'has_profit_share': False,
-        'profit_share_bonus': 0
-    },
-    'Ambassador 2 (AMB2)': {
-        'level1_bonus': 0.001,
-        'level2_bonus': 0.0005,
-        'level3_bonus': 0,
-        'level1_gen_bonus': 0,
-        'level2_gen_bonus': 0,
-        'level3_gen_bonus': 0,
-        'has_profit_share': False,
-        'profit_share_bonus': 0
-    },
-    'Ambassador 3 (AMB3)': {
-        'level1_bonus': 0.001,
-        'level2_bonus': 0.0007,
-        'level3_bonus': 0.0005,
-        'level1_gen_bonus': 0,
-        'level2_gen_bonus': 0,
-        'level3_gen_bonus': 0,
-        'has_profit_share': False,
-        'profit_share_bonus': 0
-    },
-    'Director 1 (DIR1)': {
-        'level1_bonus': 0.001,
-        'level2_bonus': 0.001,
-        'level3_bonus': 0.0007,
-        'level1_gen_bonus': 0.0001,
-        'level2_gen_bonus': 0,
-        'level3_gen_bonus': 0,
-        'has_profit_share': False,
-        'profit_share_bonus': 0
-    },
-    'Director 2 (DIR2)': {
-        'level1_bonus': 0.001,
-        'level2_bonus': 0.001,
-        'level3_bonus': 0.0007,
-        'level1_gen_bonus': 0.0001,
-        'level2_gen_bonus': 0.0001,
-        'level3_gen_bonus': 0,
-        'has_profit_share': False,
-        'profit_share_bonus': 0
-    },
-    'Director 3 (DIR3)': {
-        'level1_bonus': 0.001,
-        'level2_bonus': 0.001,
-        'level3_bonus': 0.0007,
-        'level1_gen_bonus': 0.0001,
-        'level2_gen_bonus': 0.0001,
-        'level3_gen_bonus': 0.0001,
-        'has_profit_share': True,
-        'profit_share_bonus': 0.0001
-    }
-}
-
 def calculate_compensation(loan_amount, interest_rate, rebate, upline_contribution, transaction_fee, annual_units):
     gross_comp = loan_amount * (rebate/100)
     upline_fee = gross_comp * (upline_contribution/100)
@@ -95,57 +14,12 @@ def calculate_compensation(loan_amount, interest_rate, rebate, upline_contributi
     annual_comp = net_comp * annual_units
     return gross_comp, net_comp, annual_comp
 
-def create_monthly_projection(annual_units, net_comp_per_loan):
-    monthly_units = annual_units / 12
-    months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-    monthly_data = []
-    cumulative_income = 0
-    
-    for month in months:
-        income = monthly_units * net_comp_per_loan
-        cumulative_income += income
-        monthly_data.append({
-            'Month': month,
-            'Monthly Income': income,
-            'Cumulative Income': cumulative_income
-        })
-    
-    return pd.DataFrame(monthly_data)
-
-def calculate_rev_share(title, level, units, avg_loan_size=445000):
-    rates = TITLE_BONUS_RATES[title]
-    volume = units * avg_loan_size
-    commissionable_volume = volume * 0.80  # 80% of volume is commissionable
-    
-    # Get base bonus rate and generational bonus for the specific level
-    if level == 'Level 1':
-        bonus_rate = rates['level1_bonus']
-        gen_bonus = rates['level1_gen_bonus']
-    elif level == 'Level 2':
-        bonus_rate = rates['level2_bonus']
-        gen_bonus = rates['level2_gen_bonus']
-    else:
-        bonus_rate = rates['level3_bonus']
-        gen_bonus = rates['level3_gen_bonus']
-    
-    # Calculate revenue share including both base bonus and generational bonus
-    rev_share = commissionable_volume * (bonus_rate + gen_bonus)
-    
-    return {
-        'volume': volume,
-        'commissionable_volume': commissionable_volume,
-        'rev_share': rev_share,
-        'bonus_rate': bonus_rate,
-        'gen_bonus': gen_bonus
-    }
-
-def calculate_profit_sharing(company_volume=2136000000):
-    profit_sharing_rate = 0.0001  # 0.01%
-    profit_sharing_share = 0.25   # 25%
-    return company_volume * profit_sharing_rate * profit_sharing_share
-
 def create_chart_image(fig):
     """Convert Plotly figure to image bytes for PDF"""
+    from PIL import Image as PILImage
+    from reportlab.lib.units import inch
+    from reportlab.platypus import Image
+
     try:
         img_bytes = fig.to_image(format="png", width=800, height=400)
         img = PILImage.open(io.BytesIO(img_bytes))
@@ -160,6 +34,13 @@ def create_chart_image(fig):
 def create_detailed_pdf_report(user_name, selected_title, all_results, total_rev_share, chart_fig, 
                              has_profit_share=False, profit_sharing=0, report_type='detailed', 
                              selected_sections=None):
+    from reportlab.lib import colors
+    from reportlab.lib.enums import TA_CENTER
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import inch
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+
     buffer = io.BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=0.5*inch)
     styles = getSampleStyleSheet()
@@ -362,8 +243,18 @@ if calculator_type == "Revenue Share Calculator":
         all_results = []
         total_rev_share = 0
         
-        for level, data in levels_data.items():
-            results = calculate_rev_share(selected_title, level, data['units'], avg_loan_size=avg_loan_size)
+        # Evaluate every level in one batched lookup against the compiled rate matrix
+        levels = list(levels_data.keys())
+        batch = calculate_rev_share_batch(
+            RATE_MATRIX,
+            RATE_MATRIX['title_codes'][selected_title],
+            encode_levels(levels),
+            [data['units'] for data in levels_data.values()],
+            avg_loan_size=avg_loan_size
+        )
+        
+        for i, (level, data) in enumerate(levels_data.items()):
+            results = {key: values[i] for key, values in batch.items()}
             all_results.append({
                 'Level': level,
                 'LO Count': level1_count if level == 'Level 1' else level2_count if level == 'Level 2' else level3_count,
@@ -390,6 +281,8 @@ if calculator_type == "Revenue Share Calculator":
                 
             # Revenue share chart
             df = pd.DataFrame(all_results)
+            import plotly.express as px
+
             fig = px.bar(
                 df,
                 x='Level',
@@ -612,6 +505,8 @@ else:  # Loan Advisor Compensation Calculator
             )
 
         # Enhanced visualization
+        import plotly.graph_objects as go
+
         fig = go.Figure()
         
         fig.add_trace(go.Bar(
@@ -659,6 +554,8 @@ else:  # Loan Advisor Compensation Calculator
         ethos_monthly = create_monthly_projection(annual_units, (ethos_before_net * before_cap_units + ethos_after_net * remaining_units) / annual_units)
         
         # Monthly comparison visualization
+        import plotly.express as px
+
         fig_monthly = px.line(
             title="Monthly Income Comparison"
         )
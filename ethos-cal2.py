@@ -1,267 +1,78 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.lib.enums import TA_CENTER, TA_LEFT
+import numpy as np
+import hashlib
 import io
-from PIL import Image as PILImage
-import streamlit.components.v1 as components
-import base64
-import io
-
+import json
+import os
+import time
+from ethos_engine import (TITLE_BONUS_RATES, RATE_MATRIX, LEVELS, LEVEL_MIXES, calculate_compensation,
+                          create_monthly_projection, calculate_profit_sharing, calculate_team_thresholds, encode_levels,
+                          calculate_rev_share_batch, plan_target_income, sensitivity_grid, simulate_monthly_income)
+from ethos_reports import create_detailed_pdf_report, write_team_report
+from ethos_io import (TEAM_FILE_TYPES, TEAM_RESULT_COLUMNS, team_file_format, read_team_chunks, team_chunk_results,
+                      stream_team_compensation, export_team_results, team_results_table, query_team_results)
+from ethos_store import LoanStore
 
 # Configure the page
 st.set_page_config(page_title="Ethos Lending Calculator Suite", layout="wide")
 
-# Define your TITLE_BONUS_RATES dictionary here
-TITLE_BONUS_RATES = {
-    'Ambassador (AMB)': {
-        'level1_bonus': 0.0005,
-        'level2_bonus': 0,
-        'level3_bonus': 0,
-        'level1_gen_bonus': 0,
-        'level2_gen_bonus': 0,
-        'level3_gen_bonus': 0,
-        'has_profit_share': False,
-        'profit_share_bonus': 0
-    },
-    'Active Ambassador (AAMB)': {
-        'level1_bonus': 0.001,
-        'level2_bonus': 0,
-        'level3_bonus': 0,
-        'level1_gen_bonus': 0,
-        'level2_gen_bonus': 0,
-        'level3_gen_bonus': 0,
-        'has_profit_share': False,
-        'profit_share_bonus': 0
-    },
-    'Ambassador 2 (AMB2)': {
-        'level1_bonus': 0.001,
-        'level2_bonus': 0.0005,
-        'level3_bonus': 0,
-        'level1_gen_bonus': 0,
-        'level2_gen_bonus': 0,
-        'level3_gen_bonus': 0,
-        'has_profit_share': False,
-        'profit_share_bonus': 0
-    },
-    'Ambassador 3 (AMB3)': {
-        'level1_bonus': 0.001,
-        'level2_bonus': 0.0007,
-        'level3_bonus': 0.0005,
-        'level1_gen_bonus': 0,
-        'level2_gen_bonus': 0,
-        'level3_gen_bonus': 0,
-        'has_profit_share': False,
-        'profit_share_bonus': 0
-    },
-    'Director 1 (DIR1)': {
-        'level1_bonus': 0.001,
-        'level2_bonus': 0.001,
-        'level3_bonus': 0.0007,
-        'level1_gen_bonus': 0.0001,
-        'level2_gen_bonus': 0,
-        'level3_gen_bonus': 0,
-        'has_profit_share': False,
-        'profit_share_bonus': 0
-    },
-    'Director 2 (DIR2)': {
-        'level1_bonus': 0.001,
-        'level2_bonus': 0.001,
-        'level3_bonus': 0.0007,
-        'level1_gen_bonus': 0.0001,
-        'level2_gen_bonus': 0.0001,
-        'level3_gen_bonus': 0,
-        'has_profit_share': False,
-        'profit_share_bonus': 0
-    },
-    'Director 3 (DIR3)': {
-        'level1_bonus': 0.001,
-        'level2_bonus': 0.001,
-        'level3_bonus': 0.0007,
-        'level1_gen_bonus': 0.0001,
-        'level2_gen_bonus': 0.0001,
-        'level3_gen_bonus': 0.0001,
-        'has_profit_share': True,
-        'profit_share_bonus': 0.0001
-    }
-}
-
-def calculate_compensation(loan_amount, interest_rate, rebate, upline_contribution, transaction_fee, annual_units):
-    net_comp = loan_amount * (rebate/100) * (1 - upline_contribution/100) - transaction_fee
-    annual_comp = net_comp * annual_units
-    return net_comp, annual_comp
-
-def create_monthly_projection(annual_units, net_comp_per_loan):
-    monthly_units = annual_units / 12
-    months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-    monthly_data = []
-    cumulative_income = 0
-    
-    for month in months:
-        income = monthly_units * net_comp_per_loan
-        cumulative_income += income
-        monthly_data.append({
-            'Month': month,
-            'Monthly Income': income,
-            'Cumulative Income': cumulative_income
-        })
-    
-    return pd.DataFrame(monthly_data)
+def report_content_hash(user_name, selected_title, all_results, has_profit_share, profit_sharing,
+                        report_type, selected_sections, chart_backend='reportlab'):
+    """Stable hash of everything that ends up in the PDF report"""
+    payload = json.dumps(
+        [user_name, selected_title, all_results, has_profit_share, profit_sharing, report_type, selected_sections,
+         chart_backend],
+        sort_keys=True,
+        default=float
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
 
-def calculate_rev_share(title, level, units, avg_loan_size=445000):
-    rates = TITLE_BONUS_RATES[title]
-    volume = units * avg_loan_size
-    commissionable_volume = volume * 0.80  # 80% of volume is commissionable
-    
-    # Get base bonus rate and generational bonus for the specific level
-    if level == 'Level 1':
-        bonus_rate = rates['level1_bonus']
-        gen_bonus = rates['level1_gen_bonus']
-    elif level == 'Level 2':
-        bonus_rate = rates['level2_bonus']
-        gen_bonus = rates['level2_gen_bonus']
-    else:
-        bonus_rate = rates['level3_bonus']
-        gen_bonus = rates['level3_gen_bonus']
-    
-    # Calculate revenue share including both base bonus and generational bonus
-    rev_share = commissionable_volume * (bonus_rate + gen_bonus)
-    
-    return {
-        'volume': volume,
-        'commissionable_volume': commissionable_volume,
-        'rev_share': rev_share,
-        'bonus_rate': bonus_rate,
-        'gen_bonus': gen_bonus
-    }
-
-def calculate_profit_sharing(company_volume=2136000000):
-    profit_sharing_rate = 0.0001  # 0.01%
-    profit_sharing_share = 0.25   # 25%
-    return company_volume * profit_sharing_rate * profit_sharing_share
-
-def create_chart_image(fig):
-    """Convert Plotly figure to image bytes for PDF"""
+@st.cache_data(max_entries=32, show_spinner="Building PDF report...")
+def get_pdf_report(content_hash, _report_args):
+    """PDF bytes memoized on the report content hash, so unchanged reports are never rebuilt"""
+    return create_detailed_pdf_report(*_report_args).getvalue()
+
+@st.cache_data(max_entries=16, show_spinner="Simulating income paths...")
+def get_income_simulation(**params):
+    """Monte Carlo projection memoized on its inputs, so reruns don't resimulate"""
+    start = time.perf_counter()
+    simulation = simulate_monthly_income(**params)
+    simulation['seconds'] = time.perf_counter() - start
+    return simulation
+
+@st.cache_data(max_entries=8, show_spinner="Evaluating sensitivity grid...")
+def get_sensitivity_grid(loan_axis, units_axis, rebate_axis, interest_rate, company_split, current_transaction_fee,
+                         **ethos_params):
+    """Sensitivity grid memoized on the grid specification: each axis is (from, to, steps)"""
+    start = time.perf_counter()
+    grid = sensitivity_grid(np.linspace(*loan_axis), np.linspace(*units_axis), np.linspace(*rebate_axis),
+                            interest_rate, company_split, current_transaction_fee, **ethos_params)
+    grid['seconds'] = time.perf_counter() - start
+    return grid
+
+@st.cache_resource(show_spinner=False)
+def get_loan_store(path):
+    """One LoanStore per directory for the whole server, so its production matrix is built once and shared"""
+    return LoanStore(path)
+
+def default_loan_store_path():
+    return os.environ.get('ETHOS_LOAN_STORE', 'loan_store')
+
+def load_team_from_store(path, sponsor_id, months):
+    """Fill the Team Structure and loan size widgets from a sponsor's downline in the loan store"""
     try:
-        img_bytes = fig.to_image(format="png", width=800, height=400)
-        img = PILImage.open(io.BytesIO(img_bytes))
-        img_buffer = io.BytesIO()
-        img.save(img_buffer, format='PNG')
-        img_buffer.seek(0)
-        return Image(img_buffer, width=6*inch, height=3*inch)
-    except Exception as e:
-        print(f"Error creating chart image: {e}")
-        return None
-
-def create_detailed_pdf_report(user_name, selected_title, all_results, total_rev_share, chart_fig, 
-                             has_profit_share=False, profit_sharing=0, report_type='detailed', 
-                             selected_sections=None):
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=0.5*inch)
-    styles = getSampleStyleSheet()
-    elements = []
-    
-    # Custom styles
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        spaceAfter=30,
-        alignment=TA_CENTER
-    )
-    
-    section_style = ParagraphStyle(
-        'SectionStyle',
-        parent=styles['Heading2'],
-        fontSize=16,
-        spaceBefore=20,
-        spaceAfter=10,
-        textColor=colors.HexColor('#1a237e')
-    )
-    
-    # Title Section
-    elements.append(Paragraph(f"Revenue Share Analysis for {user_name}", title_style))
-    elements.append(Spacer(1, 20))
-    
-    # Executive Summary Section
-    if not selected_sections or 'executive_summary' in selected_sections:
-        elements.append(Paragraph("Executive Summary", section_style))
-        summary_data = [
-            ['Title', selected_title],
-            ['Total Revenue Share', f"${int(total_rev_share):,}"],
-            ['Total Loans', sum(r['Total Loans'] for r in all_results)],
-            ['Total Volume', f"${int(sum(r['Volume'] for r in all_results)):,}"]
-        ]
-        if has_profit_share:
-            summary_data.append(['Profit Sharing', f"${int(profit_sharing):,}"])
-            summary_data.append(['Total Compensation', f"${int(total_rev_share + profit_sharing):,}"])
-            
-        summary_table = Table(summary_data, colWidths=[2.5*inch, 3.5*inch])
-        summary_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#e3f2fd')),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 0), (-1, -1), 12),
-            ('GRID', (0, 0), (-1, -1), 1, colors.grey),
-            ('PADDING', (0, 0), (-1, -1), 6),
-        ]))
-        elements.append(summary_table)
-        elements.append(Spacer(1, 20))
-    
-    # Revenue Chart Section
-    if report_type == 'detailed' and (not selected_sections or 'revenue_chart' in selected_sections):
-        elements.append(Paragraph("Revenue Distribution by Level", section_style))
-        try:
-            chart_img = create_chart_image(chart_fig)
-            if chart_img:
-                elements.append(chart_img)
-            elements.append(Spacer(1, 20))
-        except Exception as e:
-            print(f"Error adding chart to PDF: {e}")
-            elements.append(Paragraph("Chart could not be generated", styles['Normal']))
-            elements.append(Spacer(1, 20))
-    
-    # Detailed Breakdown Section
-    if report_type == 'detailed' and (not selected_sections or 'level_breakdown' in selected_sections):
-        elements.append(Paragraph("Detailed Level Breakdown", section_style))
-        for result in all_results:
-            elements.append(Paragraph(f"{result['Level']} Analysis", styles['Heading3']))
-            detail_data = [
-                ['Metric', 'Value'],
-                ['LO Count', str(result['LO Count'])],
-                ['Loans per LO', str(result['Loans per LO'])],
-                ['Total Loans', str(result['Total Loans'])],
-                ['Volume', f"${int(result['Volume']):,}"],
-                ['Commissionable Volume', f"${int(result['Commissionable Volume']):,}"],
-                ['Level Bonus Rate', f"{result['Bonus Rate']*100:.2f}%"],
-                ['Generational Bonus', f"{result['Gen Bonus']*100:.2f}%"],
-                # ['Total Bonus Rate', f"{(result['Bonus Rate'] + result['Gen Bonus'])*100:.2f}%"],
-                ['Revenue Share', f"${int(result['Rev Share']):,}"]
-            ]
-            
-            detail_table = Table(detail_data, colWidths=[2.5*inch, 3.5*inch])
-            detail_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1a237e')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-                ('FONTSIZE', (0, 0), (-1, -1), 12),
-                ('GRID', (0, 0), (-1, -1), 1, colors.grey),
-                ('PADDING', (0, 0), (-1, -1), 6),
-            ]))
-            
-            elements.append(detail_table)
-            elements.append(Spacer(1, 15))
-    
-    doc.build(elements)
-    buffer.seek(0)
-    return buffer
+        levels = get_loan_store(path).level_production(sponsor_id.strip(), months=months)
+    except (ValueError, KeyError, OSError) as e:
+        st.session_state['store_error'] = str(e)
+        return
+    st.session_state.pop('store_error', None)
+    for level, count, units in zip(range(1, 4), levels['lo_count'], levels['units']):
+        st.session_state[f"l{level}_count"] = int(count)
+        st.session_state[f"l{level}_units"] = int(round(units / count)) if count else 0
+    total_units = levels['units'].sum()
+    if total_units:
+        st.session_state['avg_loan_size'] = int(round(levels['volume'].sum() / total_units))
 
 def add_report_customization():
     st.sidebar.write("---")
@@ -273,6 +84,7 @@ def add_report_customization():
     )
     
     selected_sections = None
+    chart_backend = 'reportlab'
     if report_type == 'Detailed':
         st.sidebar.subheader("Select Sections to Include")
         selected_sections = []
@@ -282,8 +94,317 @@ def add_report_customization():
             selected_sections.append('revenue_chart')
         if st.sidebar.checkbox("Level Breakdown", value=True):
             selected_sections.append('level_breakdown')
+        chart_renderer = st.sidebar.radio(
+            "Chart Renderer",
+            options=['Vector (reportlab)', 'Plotly image'],
+            index=0,
+            help="Vector charts need no headless browser and keep the PDF small"
+        )
+        chart_backend = 'reportlab' if chart_renderer == 'Vector (reportlab)' else 'plotly'
+    
+    build_on_demand = st.sidebar.checkbox(
+        "Build PDF only when requested",
+        value=True,
+        help="Skips building the PDF on every change; the report is generated when you ask for it"
+    )
+    
+    return report_type.lower(), selected_sections, chart_backend, build_on_demand
+
+
+def show_team_charts(comp_data, top_n=25):
+    """Compensation bars for the top earners and a volume pie of the largest producers plus everyone else
+
+    Only `top_n` members are charted, so large teams stay light on the wire.
+    """
+    import plotly.graph_objects as go
+
+    top_earners = comp_data.nlargest(top_n, 'ethosComp')
+    fig = go.Figure()
+    
+    # Compensation comparison chart
+    fig.add_trace(go.Bar(
+        name='Current Compensation',
+        x=top_earners['name'],
+        y=top_earners['currentComp'],
+        marker_color='rgb(55, 83, 109)'
+    ))
+    
+    fig.add_trace(go.Bar(
+        name='ETHOS Total',
+        x=top_earners['name'],
+        y=top_earners['ethosComp'],
+        marker_color='rgb(0, 191, 255)'
+    ))
+    
+    fig.update_layout(
+        title=('Team Compensation Comparison' if len(comp_data) <= top_n
+               else f'Team Compensation Comparison (top {top_n} of {len(comp_data):,} by ETHOS pay)'),
+        yaxis_title='Compensation ($)',
+        barmode='group',
+        showlegend=True,
+        height=500
+    )
     
-    return report_type.lower(), selected_sections
+    st.plotly_chart(fig, use_container_width=True)
+    
+    # Volume distribution pie chart: the largest producers, with everyone else in one slice
+    top_volume = comp_data.nlargest(top_n, 'volume')
+    labels = top_volume['name'].astype(str).tolist()
+    values = top_volume['volume'].tolist()
+    if len(comp_data) > top_n:
+        labels.append(f"All other {len(comp_data) - top_n:,} members")
+        values.append(comp_data['volume'].sum() - sum(values))
+    fig2 = go.Figure(data=[go.Pie(
+        labels=labels,
+        values=values,
+        hole=.3
+    )])
+    
+    fig2.update_layout(
+        title='Loan Volume Distribution',
+        height=500
+    )
+    
+    st.plotly_chart(fig2, use_container_width=True)
+
+def show_team_results(comp_data, key):
+    """Paginated team results table, filtered and sorted server-side and sent one Arrow page at a time"""
+    table = team_results_table(comp_data)
+    
+    controls = st.columns(4)
+    with controls[0]:
+        name_filter = st.text_input("Filter by Name", key=f"{key}_filter")
+    with controls[1]:
+        sort_by = st.selectbox("Sort by", options=TEAM_RESULT_COLUMNS, key=f"{key}_sort")
+    with controls[2]:
+        descending = st.checkbox("Descending", value=False, key=f"{key}_descending")
+    with controls[3]:
+        page_size = st.selectbox("Rows per page", options=[25, 50, 100, 500], index=1, key=f"{key}_page_size")
+    
+    matching = query_team_results(table, name_filter, sort_by, descending)
+    page_count = max(1, -(-matching.num_rows // page_size))
+    page = st.number_input(f"Page (of {page_count:,})", min_value=1, max_value=page_count, value=1, step=1,
+                           key=f"{key}_page")
+    page = min(page, page_count)
+    
+    st.dataframe(matching.slice((page - 1) * page_size, page_size), use_container_width=True, hide_index=True)
+    st.caption(f"{matching.num_rows:,} of {table.num_rows:,} team members")
+
+def offer_team_report_download(comp_data, key, label="Download Team Report"):
+    """Build the full HTML report only when the user asks for it"""
+    fingerprint = int(pd.util.hash_pandas_object(comp_data, index=False).sum())
+    report = st.session_state.get(f"{key}_report")
+    if report is not None and report[0] == fingerprint:
+        st.download_button(
+            label=label,
+            data=report[1],
+            file_name="team_report.html",
+            mime="text/html"
+        )
+    elif st.button("Prepare Team Report", key=f"{key}_prepare_report"):
+        report_file = write_team_report(comp_data, io.BytesIO())
+        st.session_state[f"{key}_report"] = (fingerprint, report_file.getvalue())
+        st.rerun()
+
+def offer_team_export_downloads(comp_data, key):
+    """Serialise the results to Parquet / Arrow only when the user asks for that format"""
+    fingerprint = int(pd.util.hash_pandas_object(comp_data, index=False).sum())
+    export_cols = st.columns(2)
+    for col, (file_format, label, mime) in zip(export_cols, [
+            ('parquet', "Parquet", "application/vnd.apache.parquet"),
+            ('arrow', "Arrow", "application/vnd.apache.arrow.file")]):
+        export = st.session_state.get(f"{key}_{file_format}_export")
+        with col:
+            if export is not None and export[0] == fingerprint:
+                st.download_button(
+                    label=f"💾 Download Results ({label})",
+                    data=export[1],
+                    file_name=f"team_results.{file_format}",
+                    mime=mime
+                )
+            elif st.button(f"Prepare {label} Export", key=f"{key}_prepare_{file_format}"):
+                st.session_state[f"{key}_{file_format}_export"] = (fingerprint,
+                                                                   export_team_results(comp_data, file_format))
+                st.rerun()
+
+def grid_axis_input(label, start, stop, steps, step, key):
+    """From / To / Steps inputs for one sensitivity grid axis"""
+    cols = st.columns(3)
+    start = cols[0].number_input(f"{label} From", value=start, step=step, key=f"{key}_from")
+    stop = cols[1].number_input(f"{label} To", value=stop, step=step, key=f"{key}_to")
+    steps = cols[2].number_input(f"{label} Steps", min_value=2, max_value=2000, value=steps, step=1, key=f"{key}_steps")
+    return start, stop, int(steps)
+
+def show_sensitivity_grid(interest_rate, company_split, current_transaction_fee, ethos_params, max_cells=5_000_000):
+    """Heatmaps and slice charts of additional compensation over loan size x annual units x current rebate"""
+    import plotly.graph_objects as go
+
+    loan_axis = grid_axis_input("Loan Size ($)", 200000.0, 1000000.0, 100, 10000.0, "grid_loan")
+    units_axis = grid_axis_input("Annual Units", 0.0, 100.0, 101, 1.0, "grid_units")
+    rebate_axis = grid_axis_input("Current Rebate (%)", 0.5, 3.0, 100, 0.1, "grid_rebate")
+
+    cells = loan_axis[2] * units_axis[2] * rebate_axis[2]
+    if cells > max_cells:
+        st.warning(f"The grid has {cells:,} cells; reduce the steps to at most {max_cells:,} cells.")
+        return
+
+    grid = get_sensitivity_grid(loan_axis, units_axis, rebate_axis, interest_rate, company_split,
+                                current_transaction_fee, **ethos_params)
+    loan_sizes, annual_units, rebates = grid['loan_sizes'], grid['annual_units'], grid['current_rebates']
+    additional = grid['additional_comp']
+
+    metric_cols = st.columns(3)
+    metric_cols[0].metric("Grid Cells", f"{additional.size:,}")
+    metric_cols[1].metric("Cells Where ETHOS Pays More", f"{(additional > 0).mean():.1%}")
+    metric_cols[2].metric("Largest Additional Compensation", f"${additional.max():,.0f}")
+    st.caption(f"Evaluated in {grid['seconds'] * 1000:,.0f} ms")
+
+    # Slices are picked by grid index so every selection lands exactly on an evaluated cell
+    slice_cols = st.columns(3)
+    with slice_cols[0]:
+        i = st.select_slider("Loan Size Slice", options=range(len(loan_sizes)), value=len(loan_sizes) // 2,
+                             format_func=lambda idx: f"${loan_sizes[idx]:,.0f}")
+    with slice_cols[1]:
+        j = st.select_slider("Annual Units Slice", options=range(len(annual_units)), value=len(annual_units) // 2,
+                             format_func=lambda idx: f"{annual_units[idx]:,.1f}")
+    with slice_cols[2]:
+        k = st.select_slider("Current Rebate Slice", options=range(len(rebates)), value=len(rebates) // 2,
+                             format_func=lambda idx: f"{rebates[idx]:.2f}%")
+
+    def heatmap(z, x, y, title, xaxis_title, yaxis_title):
+        fig = go.Figure(go.Heatmap(z=z, x=x, y=y, colorscale='RdBu', zmid=0,
+                                   colorbar=dict(title='Additional ($)')))
+        fig.update_layout(title=title, xaxis_title=xaxis_title, yaxis_title=yaxis_title, height=500)
+        return fig
+
+    heatmap_cols = st.columns(2)
+    with heatmap_cols[0]:
+        st.plotly_chart(heatmap(additional[:, :, k], annual_units, loan_sizes,
+                                f"Additional Compensation at {rebates[k]:.2f}% Current Rebate",
+                                'Annual Units', 'Loan Size ($)'), use_container_width=True)
+    with heatmap_cols[1]:
+        st.plotly_chart(heatmap(additional[i, :, :].T, annual_units, rebates,
+                                f"Additional Compensation at ${loan_sizes[i]:,.0f} Loan Size",
+                                'Annual Units', 'Current Rebate (%)'), use_container_width=True)
+
+    line_cols = st.columns(3)
+    for col, x, y, xaxis_title in [
+        (line_cols[0], loan_sizes, additional[:, j, k], 'Loan Size ($)'),
+        (line_cols[1], annual_units, additional[i, :, k], 'Annual Units'),
+        (line_cols[2], rebates, additional[i, j, :], 'Current Rebate (%)')
+    ]:
+        fig = go.Figure(go.Scatter(x=x, y=y, mode='lines', line=dict(color='rgb(26, 118, 255)')))
+        fig.add_hline(y=0, line_dash='dash', line_color='grey')
+        fig.update_layout(title=f"Additional Compensation vs {xaxis_title}", xaxis_title=xaxis_title,
+                          yaxis_title='Additional ($)', height=350)
+        col.plotly_chart(fig, use_container_width=True)
+
+def show_income_simulation(comp_params, cap_units, cap_volume):
+    """P10/P50/P90 cumulative income bands for current lender vs ETHOS over simulated years"""
+    import plotly.graph_objects as go
+
+    controls = st.columns(4)
+    with controls[0]:
+        # Capped at the path count that still simulates well under a second on one core
+        paths = st.select_slider("Simulated Paths", options=[25_000, 50_000, 100_000, 250_000],
+                                 value=100_000, format_func=lambda n: f"{n:,}")
+    with controls[1]:
+        units_model = st.radio("Monthly Loan Count", ["Poisson", "Negative binomial"],
+                               help="Negative binomial allows burstier months than Poisson")
+        units_dispersion = None
+        if units_model == "Negative binomial":
+            units_dispersion = st.slider("Dispersion", min_value=0.5, max_value=20.0, value=2.0, step=0.5,
+                                         help="Lower values mean more month-to-month variation")
+    with controls[2]:
+        loan_size_cv = st.slider("Loan Size Variation (%)", min_value=0, max_value=100, value=25, step=5,
+                                 help="Standard deviation of loan sizes as a percentage of the average") / 100
+    with controls[3]:
+        cap_basis = st.radio("ETHOS Cap", [f"{cap_units} loans", f"${cap_volume / 1e6:,.0f}M volume"])
+
+    simulation = get_income_simulation(
+        **comp_params,
+        cap_units=cap_units,
+        cap_volume=None if cap_basis == f"{cap_units} loans" else cap_volume,
+        paths=paths,
+        units_dispersion=units_dispersion,
+        loan_size_cv=loan_size_cv,
+        seed=42
+    )
+    months = simulation['months']
+
+    fig = go.Figure()
+    for name, bands, color in [('Current Lender', simulation['current'], '55, 83, 109'),
+                               ('ETHOS', simulation['ethos'], '26, 118, 255')]:
+        p10, p50, p90 = bands
+        fig.add_trace(go.Scatter(x=months, y=p90, mode='lines', line=dict(width=0), showlegend=False,
+                                 hoverinfo='skip'))
+        fig.add_trace(go.Scatter(x=months, y=p10, mode='lines', line=dict(width=0), fill='tonexty',
+                                 fillcolor=f'rgba({color}, 0.2)', name=f'{name} P10-P90', hoverinfo='skip'))
+        fig.add_trace(go.Scatter(x=months, y=p50, mode='lines+markers', line=dict(color=f'rgb({color})'),
+                                 name=f'{name} P50'))
+    fig.update_layout(
+        title="Simulated Cumulative Income (P10 / P50 / P90)",
+        xaxis_title='Month',
+        yaxis_title='Cumulative Income ($)',
+        hovermode='x unified',
+        height=500
+    )
+    st.plotly_chart(fig, use_container_width=True)
+
+    st.subheader("Annual Income Percentiles")
+    annual = pd.DataFrame({
+        'Percentile': [f"P{p}" for p in simulation['percentiles']],
+        'Current Lender': simulation['current'][:, -1],
+        'ETHOS': simulation['ethos'][:, -1],
+    })
+    annual['Difference'] = annual['ETHOS'] - annual['Current Lender']
+    st.dataframe(
+        annual.style.format({'Current Lender': '${:,.2f}', 'ETHOS': '${:,.2f}', 'Difference': '${:,.2f}'}),
+        use_container_width=True,
+        hide_index=True
+    )
+    st.metric("Paths Where ETHOS Comes Out Ahead", f"{simulation['ethos_ahead']:.1%}")
+    st.caption(f"{simulation['paths']:,} paths simulated in {simulation['seconds']:.2f}s")
+
+def show_target_income_planner(level_units, loans_per_lo, avg_loan_size):
+    """Loans and LOs needed per level at every title to reach a target income"""
+    import plotly.graph_objects as go
+
+    controls = st.columns(2)
+    with controls[0]:
+        target_income = st.number_input("Target Annual Income ($)", value=100000, min_value=0, step=5000)
+    level_mixes = dict(LEVEL_MIXES)
+    if sum(level_units) > 0:
+        level_mixes = {'Current team mix': tuple(level_units), **level_mixes}
+    with controls[1]:
+        selected_mix = st.selectbox("Spread Loans Across Levels", options=list(level_mixes),
+                                    help="Relative share of the required loans at each level")
+
+    # Loans per LO of zero can't be staffed, so LO counts fall back to one loan per LO
+    plan = plan_target_income(target_income, level_mixes, avg_loan_size=avg_loan_size,
+                              loans_per_lo=[max(n, 1) for n in loans_per_lo])
+    m = plan['mixes'].index(selected_mix)
+
+    def needed(values):
+        return [f"{value:,.0f}" if np.isfinite(value) else "Not reachable" for value in values]
+
+    table = pd.DataFrame({'Title': plan['titles']})
+    for k, level in enumerate(LEVELS):
+        table[f"{level} Loans"] = needed(np.ceil(plan['units'][:, m, k]))
+        table[f"{level} LOs"] = needed(plan['lo_count'][:, m, k])
+    table['Total Loans'] = needed(np.ceil(plan['total_units'][:, m]))
+    table['Profit Sharing'] = [f"${value:,.0f}" for value in plan['profit_sharing']]
+    st.dataframe(table, use_container_width=True, hide_index=True)
+    st.caption(f"LO counts use the Loans per LO from the sidebar; loans are at ${avg_loan_size:,.0f} each")
+
+    fig = go.Figure()
+    for m, mix in enumerate(plan['mixes']):
+        reachable = plan['reachable'][:, m]
+        fig.add_trace(go.Bar(x=[title for title, ok in zip(plan['titles'], reachable) if ok],
+                             y=plan['total_units'][reachable, m], name=mix))
+    fig.update_layout(title=f"Loans Needed for ${target_income:,.0f} by Title", barmode='group',
+                      xaxis_title='Title', yaxis_title='Total Loans', height=450)
+    st.plotly_chart(fig, use_container_width=True)
 
 
 # Create tabs for different calculators
@@ -307,6 +428,16 @@ if calculator_type == "Revenue Share Calculator":
             index=6
         )
         
+        with st.expander("Load Team from Loan Store"):
+            store_path = st.text_input("Loan Store Directory", value=default_loan_store_path(), key="rs_store_path")
+            sponsor_id = st.text_input("Your LO ID", key="rs_sponsor_id")
+            store_months = st.number_input("Months of History", value=12, min_value=1, max_value=120,
+                                           key="rs_store_months")
+            st.button("Load Team", on_click=load_team_from_store, args=(store_path, sponsor_id, store_months),
+                      disabled=not sponsor_id)
+            if 'store_error' in st.session_state:
+                st.error(st.session_state['store_error'])
+
         st.header("Team Structure")
         
         # Level 1
@@ -335,7 +466,8 @@ if calculator_type == "Revenue Share Calculator":
         
         # Loan Parameters
         st.header("Loan Parameters")
-        avg_loan_size = st.number_input("Average Loan Size ($)", value=445000, min_value=0, step=1000)
+        avg_loan_size = st.number_input("Average Loan Size ($)", value=445000, min_value=0, step=1000,
+                                        key="avg_loan_size")
 
         # Display calculated total units
         st.header("Calculated Total Units")
@@ -364,8 +496,18 @@ if calculator_type == "Revenue Share Calculator":
         all_results = []
         total_rev_share = 0
         
-        for level, data in levels_data.items():
-            results = calculate_rev_share(selected_title, level, data['units'], avg_loan_size=avg_loan_size)
+        # Evaluate every level in one batched lookup against the compiled rate matrix
+        levels = list(levels_data.keys())
+        batch = calculate_rev_share_batch(
+            RATE_MATRIX,
+            RATE_MATRIX['title_codes'][selected_title],
+            encode_levels(levels),
+            [data['units'] for data in levels_data.values()],
+            avg_loan_size=avg_loan_size
+        )
+        
+        for i, (level, data) in enumerate(levels_data.items()):
+            results = {key: values[i] for key, values in batch.items()}
             all_results.append({
                 'Level': level,
                 'LO Count': level1_count if level == 'Level 1' else level2_count if level == 'Level 2' else level3_count,
@@ -392,6 +534,8 @@ if calculator_type == "Revenue Share Calculator":
                 
             # Revenue share chart
             df = pd.DataFrame(all_results)
+            import plotly.express as px
+
             fig = px.bar(
                 df,
                 x='Level',
@@ -438,32 +582,53 @@ if calculator_type == "Revenue Share Calculator":
                 st.metric("Total Amount", f"${int(total_rev_share + profit_sharing):,}")
         
         # Get report preferences
-        report_type, selected_sections = add_report_customization()
+        report_type, selected_sections, chart_backend, build_on_demand = add_report_customization()
         
-        # Generate and offer PDF download
-        pdf_buffer = create_detailed_pdf_report(
+        has_profit_share = TITLE_BONUS_RATES[selected_title]['has_profit_share']
+        report_profit_sharing = profit_sharing if has_profit_share else 0
+        report_hash = report_content_hash(
+            user_name, selected_title, all_results, has_profit_share,
+            report_profit_sharing, report_type, selected_sections, chart_backend
+        )
+        report_args = (
             user_name,
             selected_title,
             all_results,
             total_rev_share,
             fig,
-            TITLE_BONUS_RATES[selected_title]['has_profit_share'],
-            profit_sharing if TITLE_BONUS_RATES[selected_title]['has_profit_share'] else 0,
+            has_profit_share,
+            report_profit_sharing,
             report_type,
-            selected_sections
+            selected_sections,
+            chart_backend
         )
         
-        st.download_button(
-            "Download PDF Report",
-            pdf_buffer,
-            f"revenue_share_{user_name.lower().replace(' ', '_')}.pdf",
-            "application/pdf"
-        )
+        # In deferred mode the PDF is only built after the user asks for it, and only
+        # while the inputs still match what was requested
+        if not build_on_demand or st.session_state.get('requested_report_hash') == report_hash:
+            st.download_button(
+                "Download PDF Report",
+                get_pdf_report(report_hash, report_args),
+                f"revenue_share_{user_name.lower().replace(' ', '_')}.pdf",
+                "application/pdf"
+            )
+        elif st.button("Generate PDF Report"):
+            st.session_state['requested_report_hash'] = report_hash
+            st.rerun()
+
+    st.write("---")
+    st.header("Target Income Planner")
+    show_target_income_planner(
+        [level1_total_units, level2_total_units, level3_total_units],
+        [level1_units_per_lo, level2_units_per_lo, level3_units_per_lo],
+        avg_loan_size
+    )
 
 else:  # Loan Advisor Compensation Calculator
     st.title("💰 Loan Advisor Compensation Calculator")
     
-    tab1, tab2, tab3, tab4 = st.tabs(["Calculator", "Monthly Projections", "Team Management", "Upload Team"])
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["Calculator", "Monthly Projections", "Team Management", "Upload Team",
+                                            "Sensitivity"])
     
     with tab1:
         st.write("Compare your compensation between current lender and ETHOS")
@@ -519,6 +684,11 @@ else:  # Loan Advisor Compensation Calculator
                 help="Fee charged per transaction"
             )
 
+        # Tabs 3 and 4 rebind these names to their own inputs, so the Sensitivity tab keeps the Calculator's values
+        calculator_interest_rate = interest_rate
+        calculator_company_split = company_split
+        calculator_transaction_fee = current_transaction_fee
+
         # ETHOS calculations
         ethos_rebate = 1.70 
         ethos_transaction_fee = 495
@@ -614,6 +784,9 @@ else:  # Loan Advisor Compensation Calculator
                 )
 
         # Enhanced visualization
+        import plotly.express as px
+        import plotly.graph_objects as go
+
         fig = go.Figure()
 
         fig.add_trace(go.Bar(
@@ -665,55 +838,71 @@ else:  # Loan Advisor Compensation Calculator
     with tab2:
         st.header("Monthly Projections")
         
-        # Create monthly projections
-        current_monthly = create_monthly_projection(annual_units, current_net)
-        ethos_monthly = create_monthly_projection(annual_units, (ethos_before_net * before_cap_units + ethos_after_net * remaining_units) / annual_units)
-        
-        # Monthly comparison visualization
-        fig_monthly = px.line(
-            title="Monthly Income Comparison"
+        projection_mode = st.radio(
+            "Projection Mode",
+            ["Average", "Monte Carlo simulation"],
+            horizontal=True,
+            help="Average spreads annual units evenly over the year; the simulation draws monthly loan counts and sizes"
         )
         
-        fig_monthly.add_scatter(
-            x=current_monthly['Month'],
-            y=current_monthly['Cumulative Income'],
-            name='Current Lender',
-            mode='lines+markers'
-        )
+        if projection_mode == "Monte Carlo simulation":
+            show_income_simulation(
+                dict(loan_amount=loan_amount, annual_units=annual_units, current_rebate=current_rebate,
+                     company_split=company_split, current_transaction_fee=current_transaction_fee,
+                     ethos_rebate=ethos_rebate, ethos_before_upline=ethos_before_upline,
+                     ethos_after_upline=ethos_after_upline, ethos_transaction_fee=ethos_transaction_fee),
+                cap_units, cap_volume
+            )
+        else:
+            # Create monthly projections
+            current_monthly = create_monthly_projection(annual_units, current_net)
+            ethos_monthly = create_monthly_projection(annual_units, (ethos_before_net * before_cap_units + ethos_after_net * remaining_units) / annual_units)
         
-        fig_monthly.add_scatter(
-            x=ethos_monthly['Month'],
-            y=ethos_monthly['Cumulative Income'],
-            name='ETHOS',
-            mode='lines+markers'
-        )
+            # Monthly comparison visualization
+            fig_monthly = px.line(
+                title="Monthly Income Comparison"
+            )
         
-        fig_monthly.update_layout(
-            xaxis_title='Month',
-            yaxis_title='Cumulative Income ($)',
-            hovermode='x unified',
-            height=500
-        )
+            fig_monthly.add_scatter(
+                x=current_monthly['Month'],
+                y=current_monthly['Cumulative Income'],
+                name='Current Lender',
+                mode='lines+markers'
+            )
         
-        st.plotly_chart(fig_monthly, use_container_width=True)
+            fig_monthly.add_scatter(
+                x=ethos_monthly['Month'],
+                y=ethos_monthly['Cumulative Income'],
+                name='ETHOS',
+                mode='lines+markers'
+            )
+        
+            fig_monthly.update_layout(
+                xaxis_title='Month',
+                yaxis_title='Cumulative Income ($)',
+                hovermode='x unified',
+                height=500
+            )
         
-        # Monthly comparison table
-        st.subheader("Monthly Income Breakdown")
-        comparison_df = pd.DataFrame({
-            'Month': current_monthly['Month'],
-            'Current Monthly': current_monthly['Monthly Income'],
-            'ETHOS Monthly': ethos_monthly['Monthly Income'],
-            'Monthly Difference': ethos_monthly['Monthly Income'] - current_monthly['Monthly Income']
-        })
+            st.plotly_chart(fig_monthly, use_container_width=True)
         
-        st.dataframe(
-            comparison_df.style.format({
-                'Current Monthly': '${:,.2f}',
-                'ETHOS Monthly': '${:,.2f}',
-                'Monthly Difference': '${:,.2f}'
-            }),
-            use_container_width=True
-        )
+            # Monthly comparison table
+            st.subheader("Monthly Income Breakdown")
+            comparison_df = pd.DataFrame({
+                'Month': current_monthly['Month'],
+                'Current Monthly': current_monthly['Monthly Income'],
+                'ETHOS Monthly': ethos_monthly['Monthly Income'],
+                'Monthly Difference': ethos_monthly['Monthly Income'] - current_monthly['Monthly Income']
+            })
+        
+            st.dataframe(
+                comparison_df.style.format({
+                    'Current Monthly': '${:,.2f}',
+                    'ETHOS Monthly': '${:,.2f}',
+                    'Monthly Difference': '${:,.2f}'
+                }),
+                use_container_width=True
+            )
 
     with tab3:
         st.title("Team Performance Dashboard")
@@ -734,8 +923,29 @@ else:  # Loan Advisor Compensation Calculator
         ethos_before_upline = 0.25
         ethos_after_upline = 0.0
         cap_units = 20
+        cap_volume = 10000000  # $10 million cap
 
-        num_members = st.number_input("Number of Team Members", min_value=1, value=1, step=1)
+        team_source = st.radio("Team Source", ["Enter manually", "Loan store"], horizontal=True)
+
+        if team_source == "Loan store":
+            store_cols = st.columns([3, 1])
+            store_path = store_cols[0].text_input("Loan Store Directory", value=default_loan_store_path())
+            store_months = store_cols[1].number_input("Months of History", min_value=1, max_value=120, value=12)
+            if st.button("Load Team", key="load_store_team"):
+                try:
+                    store = get_loan_store(store_path)
+                    # Annual Units and Loan Size come from the store's per-LO monthly aggregates, with no loan rescan
+                    st.session_state['team_results'] = team_chunk_results(
+                        store.team_summary(months=store_months), interest_rate, current_rebate, company_split,
+                        current_transaction_fee, cap_volume=cap_volume, ethos_rebate=ethos_rebate,
+                        ethos_before_upline=ethos_before_upline, ethos_after_upline=ethos_after_upline,
+                        ethos_transaction_fee=ethos_transaction_fee, cap_units=cap_units)
+                    st.caption(f"{store.manifest['rows']:,} loans in the store")
+                except (ValueError, OSError) as e:
+                    st.error(str(e))
+            num_members = 0
+        else:
+            num_members = st.number_input("Number of Team Members", min_value=1, value=1, step=1)
 
         members_data = []
         for i in range(int(num_members)):
@@ -747,7 +957,7 @@ else:  # Loan Advisor Compensation Calculator
                 "units": cols[2].number_input(f"Units {i+1}", value=50, step=1, key=f"units_{i}")
             })
 
-        if st.button("Calculate"):
+        if team_source == "Enter manually" and st.button("Calculate"):
             results = []
             for member in members_data:
                 if member["name"]:
@@ -774,134 +984,23 @@ else:  # Loan Advisor Compensation Calculator
                         "ethosAfterCap": after_cap_comp
                     })
 
+            team_results = None
             if results:
-                fig = go.Figure()
-                comp_data = pd.DataFrame(results)
-                
-                fig.add_trace(go.Bar(
-                    name='Current Compensation',
-                    x=comp_data['name'],
-                    y=comp_data['currentComp'],
-                    marker_color='rgb(55, 83, 109)'
-                ))
-                
-                fig.add_trace(go.Bar(
-                    name='ETHOS Total',
-                    x=comp_data['name'],
-                    y=comp_data['ethosComp'],
-                    marker_color='rgb(0, 191, 255)'
-                ))
-                
-                fig.update_layout(
-                    title='Team Compensation Comparison',
-                    yaxis_title='Compensation ($)',
-                    barmode='group',
-                    showlegend=True,
-                    height=500
-                )
-                
-                st.plotly_chart(fig, use_container_width=True)
-                
-                # Volume distribution pie chart
-                fig2 = go.Figure(data=[go.Pie(
-                    labels=comp_data['name'],
-                    values=comp_data['volume'],
-                    hole=.3
-                )])
-                
-                fig2.update_layout(
-                    title='Loan Volume Distribution',
-                    height=500
-                )
-                
-                st.plotly_chart(fig2, use_container_width=True)
-                html_content = f"""
-                <html>
-                <head>
-                    <title>Team Compensation Report</title>
-                    <style>
-                        :root {{
-                            color-scheme: light dark;
-                        }}
-                        body {{ 
-                            font-family: Arial, sans-serif; 
-                            padding: 20px;
-                        }}
-                        @media (prefers-color-scheme: dark) {{
-                            body {{
-                                background: #1a1a1a;
-                                color: #fff;
-                            }}
-                            th {{ background: #333; }}
-                            th, td {{ border-color: #444; }}
-                        }}
-                        @media (prefers-color-scheme: light) {{
-                            body {{
-                                background: #fff;
-                                color: #000;
-                            }}
-                            th {{ background: #f5f5f5; }}
-                            th, td {{ border-color: #ddd; }}
-                        }}
-                        table {{ 
-                            width: 100%; 
-                            border-collapse: collapse; 
-                            margin: 20px 0;
-                        }}
-                        th, td {{ 
-                            padding: 12px;
-                            border-width: 1px;
-                            border-style: solid;
-                            text-align: left; 
-                        }}
-                        .summary {{ margin-top: 20px; }}
-                    </style>
-                </head>
-                    <body>
-                        <h2>Team Compensation Report</h2>
-                        <table>
-                            <tr>
-                                <th>Name</th>
-                                <th>Loan Size</th>
-                                <th>Units</th>
-                                <th>Volume</th>
-                                <th>Current Comp</th>
-                                <th>ETHOS Before Cap</th>
-                                <th>ETHOS After Cap</th>
-                                <th>ETHOS Total</th>
-                            </tr>
-                            {''.join([f'''
-                            <tr>
-                                <td>{r['name']}</td>
-                                <td>${r['loan_size']:,.2f}</td>
-                                <td>{r['units']}</td>
-                                <td>${r['volume']:,.2f}</td>
-                                <td>${r['currentComp']:,.2f}</td>
-                                <td>${r['ethosBeforeCap']:,.2f}</td>
-                                <td>${r['ethosAfterCap']:,.2f}</td>
-                                <td>${r['ethosComp']:,.2f}</td>
-                            </tr>
-                            ''' for r in results])}
-                        </table>
-                        <div class="summary">
-                            <h3>Summary</h3>
-                            <p>Total Volume: ${sum(r['volume'] for r in results):,.2f}</p>
-                            <p>Total Current Compensation: ${sum(r['currentComp'] for r in results):,.2f}</p>
-                            <p>Total ETHOS Compensation: ${sum(r['ethosComp'] for r in results):,.2f}</p>
-                            <p>Additional Team Compensation with ETHOS: ${sum(r['ethosComp'] for r in results) - sum(r['currentComp'] for r in results):,.2f}</p>
-                        </div>
-                    </body>
-                </html>
-                """
-
-                components.html(html_content, height=800)
+                team_results = pd.DataFrame(results)
+                team_results = team_results.assign(**calculate_team_thresholds(
+                    team_results['loan_size'], team_results['units'], interest_rate,
+                    current_rebate, company_split, current_transaction_fee,
+                    ethos_rebate, ethos_before_upline, ethos_after_upline,
+                    ethos_transaction_fee, cap_units, cap_volume))
+            # Keep results across reruns so paging and sorting don't need another Calculate
+            st.session_state['team_results'] = team_results
 
-                st.download_button(
-                    label="Download Team Report",
-                    data=html_content,
-                    file_name="team_report.html",
-                    mime="text/html"
-                )
+        comp_data = st.session_state.get('team_results')
+        if comp_data is not None:
+            show_team_charts(comp_data)
+
+            show_team_results(comp_data, key="team")
+            offer_team_report_download(comp_data, key="team")
 
     with tab4:
             st.title("Upload Team Data")
@@ -941,187 +1040,101 @@ else:  # Loan Advisor Compensation Calculator
             
             # File upload
             st.subheader("3. Upload Team Data")
-            uploaded_file = st.file_uploader("Choose a CSV file", type='csv')
+            uploaded_file = st.file_uploader("Choose a CSV, Parquet or Arrow file", type=TEAM_FILE_TYPES)
+            stream_upload = st.checkbox(
+                "Stream large files in chunks",
+                value=False,
+                help="Reads only the Name, Loan Size and Annual Units columns in bounded chunks and accumulates team totals without loading the whole file"
+            )
+            csv_engine = st.radio("CSV Engine", ['pandas', 'pyarrow'], horizontal=True, key="upload_csv_engine")
+            
+            # ETHOS parameters
+            ethos_rebate = 1.70
+            ethos_transaction_fee = 495
+            ethos_before_upline = 0.25
+            ethos_after_upline = 0.0
+            cap_units = 20
+            cap_volume = 10000000  # $10 million cap
             
-            if uploaded_file is not None:
+            if uploaded_file is not None and stream_upload:
                 try:
-                    df = pd.read_csv(uploaded_file)
-                    required_columns = ['Name', 'Loan Size', 'Annual Units']
+                    status = st.empty()
+                    preview = []
+                    preview_rows = 0
+                    totals = None
+                    for chunk_results, totals in stream_team_compensation(
+                            read_team_chunks(uploaded_file, engine=csv_engine, file_format=team_file_format(uploaded_file.name)),
+                            interest_rate,
+                            current_rebate, company_split, current_transaction_fee,
+                            ethos_rebate=ethos_rebate, ethos_before_upline=ethos_before_upline,
+                            ethos_after_upline=ethos_after_upline,
+                            ethos_transaction_fee=ethos_transaction_fee, cap_units=cap_units, cap_volume=cap_volume):
+                        # Only keep a bounded preview; everything else is folded into the running totals
+                        if preview_rows < 1000:
+                            preview.append(chunk_results.head(1000 - preview_rows))
+                            preview_rows += len(preview[-1])
+                        status.info(f"Processed {totals['members']:,} team members...")
                     
-                    if not all(col in df.columns for col in required_columns):
-                        st.error("Upload file must contain columns: Name, Loan Size, Annual Units")
+                    if totals is None:
+                        status.warning("Upload file contains no team members")
                     else:
-                        # ETHOS parameters
-                        ethos_rebate = 1.70
-                        ethos_transaction_fee = 495
-                        ethos_before_upline = 0.25
-                        ethos_after_upline = 0.0
-                        cap_units = 20
-                        
-                        # Calculate compensation for each team member
-                        results = []
-                        for _, row in df.iterrows():
-                            before_cap_comp = calculate_compensation(
-                                row['Loan Size'], interest_rate, ethos_rebate,
-                                ethos_before_upline, ethos_transaction_fee,
-                                min(row['Annual Units'], cap_units))[1]
-                                
-                            after_cap_comp = calculate_compensation(
-                                row['Loan Size'], interest_rate, ethos_rebate,
-                                ethos_after_upline, ethos_transaction_fee,
-                                max(0, row['Annual Units'] - cap_units))[1]
-                                
-                            current_comp = calculate_compensation(
-                                row['Loan Size'], interest_rate, current_rebate,
-                                company_split, current_transaction_fee,
-                                row['Annual Units'])[1]
-                                
-                            results.append({
-                                "name": row['Name'],
-                                "loan_size": row['Loan Size'],
-                                "units": row['Annual Units'],
-                                "volume": row['Loan Size'] * row['Annual Units'],
-                                "currentComp": current_comp,
-                                "ethosComp": before_cap_comp + after_cap_comp,
-                                "ethosBeforeCap": before_cap_comp,
-                                "ethosAfterCap": after_cap_comp
-                            })
-                        
-                        # Create visualizations
-                        fig = go.Figure()
-                        
-                        # Compensation comparison chart
-                        comp_data = pd.DataFrame(results)
-                        fig.add_trace(go.Bar(
-                            name='Current Compensation',
-                            x=comp_data['name'],
-                            y=comp_data['currentComp'],
-                            marker_color='rgb(55, 83, 109)'
-                        ))
-                        
-                        fig.add_trace(go.Bar(
-                            name='ETHOS Total',
-                            x=comp_data['name'],
-                            y=comp_data['ethosComp'],
-                            marker_color='rgb(0, 191, 255)'
-                        ))
-                        
-                        fig.update_layout(
-                            title='Team Compensation Comparison',
-                            yaxis_title='Compensation ($)',
-                            barmode='group',
-                            showlegend=True,
-                            height=500
-                        )
+                        status.success(f"Processed {totals['members']:,} team members")
+                        st.subheader("4. Team Compensation Summary")
+                        summary_cols = st.columns(4)
+                        summary_cols[0].metric("Total Volume", f"${totals['volume']:,.2f}")
+                        summary_cols[1].metric("Total Current Compensation", f"${totals['currentComp']:,.2f}")
+                        summary_cols[2].metric("Total ETHOS Compensation", f"${totals['ethosComp']:,.2f}")
+                        summary_cols[3].metric("Additional Team Compensation", f"${totals['ethosComp'] - totals['currentComp']:,.2f}")
                         
-                        st.plotly_chart(fig, use_container_width=True)
-                        
-                        # Volume distribution pie chart
-                        fig2 = go.Figure(data=[go.Pie(
-                            labels=comp_data['name'],
-                            values=comp_data['volume'],
-                            hole=.3
-                        )])
-                        
-                        fig2.update_layout(
-                            title='Loan Volume Distribution',
-                            height=500
-                        )
-                        
-                        st.plotly_chart(fig2, use_container_width=True)
-
-                        # Generate HTML report
-                        html_content = f"""
-                        <html>
-                        <head>
-                            <title>Team Compensation Report</title>
-                            <style>
-                                :root {{
-                                    color-scheme: light dark;
-                                }}
-                                body {{ 
-                                    font-family: Arial, sans-serif; 
-                                    padding: 20px;
-                                }}
-                                @media (prefers-color-scheme: dark) {{
-                                    body {{
-                                        background: #1a1a1a;
-                                        color: #fff;
-                                    }}
-                                    th {{ background: #333; }}
-                                    th, td {{ border-color: #444; }}
-                                }}
-                                @media (prefers-color-scheme: light) {{
-                                    body {{
-                                        background: #fff;
-                                        color: #000;
-                                    }}
-                                    th {{ background: #f5f5f5; }}
-                                    th, td {{ border-color: #ddd; }}
-                                }}
-                                table {{ 
-                                    width: 100%; 
-                                    border-collapse: collapse; 
-                                    margin: 20px 0;
-                                }}
-                                th, td {{ 
-                                    padding: 12px;
-                                    border-width: 1px;
-                                    border-style: solid;
-                                    text-align: left; 
-                                }}
-                                .summary {{ margin-top: 20px; }}
-                            </style>
-                        </head>
-                        <body>
-                            <h2>Team Compensation Report</h2>
-                            <table>
-                                <tr>
-                                    <th>Name</th>
-                                    <th>Loan Size</th>
-                                    <th>Units</th>
-                                    <th>Volume</th>
-                                    <th>Current Comp</th>
-                                    <th>ETHOS Before Cap</th>
-                                    <th>ETHOS After Cap</th>
-                                    <th>ETHOS Total</th>
-                                </tr>
-                                {''.join([f'''
-                                <tr>
-                                    <td>{r['name']}</td>
-                                    <td>${r['loan_size']:,.2f}</td>
-                                    <td>{r['units']}</td>
-                                    <td>${r['volume']:,.2f}</td>
-                                    <td>${r['currentComp']:,.2f}</td>
-                                    <td>${r['ethosBeforeCap']:,.2f}</td>
-                                    <td>${r['ethosAfterCap']:,.2f}</td>
-                                    <td>${r['ethosComp']:,.2f}</td>
-                                </tr>
-                                ''' for r in results])}
-                            </table>
-                            <div class="summary">
-                                <h3>Summary</h3>
-                                <p>Total Volume: ${sum(r['volume'] for r in results):,.2f}</p>
-                                <p>Total Current Compensation: ${sum(r['currentComp'] for r in results):,.2f}</p>
-                                <p>Total ETHOS Compensation: ${sum(r['ethosComp'] for r in results):,.2f}</p>
-                                <p>Additional Team Compensation with ETHOS: ${sum(r['ethosComp'] for r in results) - sum(r['currentComp'] for r in results):,.2f}</p>
-                            </div>
-                        </body>
-                        </html>
-                        """
-                        
-                        st.subheader("4. Team Compensation Report")
-                        components.html(html_content, height=800)
-                        
-                        st.download_button(
-                            label="💾 Download Team Report",
-                            data=html_content,
-                            file_name="team_report.html",
-                            mime="text/html"
+                        st.write(f"Preview of the first {preview_rows:,} team members")
+                        st.dataframe(pd.concat(preview, ignore_index=True), use_container_width=True)
+                
+                except Exception as e:
+                    st.error(f"Error processing file: {str(e)}")
+            
+            elif uploaded_file is not None:
+                try:
+                    # Results are kept per upload and parameters, so paging, sorting and filtering don't recompute
+                    upload_key = (getattr(uploaded_file, 'file_id', None) or (uploaded_file.name, uploaded_file.size),
+                                  csv_engine, interest_rate, current_rebate, company_split, current_transaction_fee)
+                    cached = st.session_state.get('upload_results')
+                    if cached is not None and cached[0] == upload_key:
+                        comp_data = cached[1]
+                    else:
+                        df = pd.concat(
+                            read_team_chunks(uploaded_file, engine=csv_engine, file_format=team_file_format(uploaded_file.name)),
+                            ignore_index=True
                         )
                         
+                        # Calculate compensation and break-even / cap thresholds for the whole team in one columnar pass
+                        comp_data = team_chunk_results(
+                            df, interest_rate, current_rebate, company_split, current_transaction_fee,
+                            cap_volume=cap_volume, ethos_rebate=ethos_rebate, ethos_before_upline=ethos_before_upline,
+                            ethos_after_upline=ethos_after_upline, ethos_transaction_fee=ethos_transaction_fee,
+                            cap_units=cap_units)
+                        st.session_state['upload_results'] = (upload_key, comp_data)
+                    
+                    show_team_charts(comp_data)
+
+                    st.subheader("4. Team Compensation Report")
+                    show_team_results(comp_data, key="upload")
+                    offer_team_report_download(comp_data, key="upload", label="💾 Download Team Report")
+                    
+                    # Columnar exports straight from the results table
+                    offer_team_export_downloads(comp_data, key="upload")
+                    
                 except Exception as e:
                     st.error(f"Error processing file: {str(e)}")
                                 # st.rerun()
 
-
+    with tab5:
+        st.header("Sensitivity Analysis")
+        st.write("Additional annual compensation with ETHOS (ETHOS total minus current lender) across loan sizes, "
+                 "annual units and current rebates, using the interest rate, company split and transaction fee from the "
+                 "Calculator tab")
+        show_sensitivity_grid(
+            calculator_interest_rate, calculator_company_split, calculator_transaction_fee,
+            dict(ethos_rebate=ethos_rebate, ethos_before_upline=ethos_before_upline,
+                 ethos_after_upline=ethos_after_upline, ethos_transaction_fee=ethos_transaction_fee,
+                 cap_units=cap_units)
+        )
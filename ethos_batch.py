@@ -0,0 +1,244 @@
+import argparse
+import multiprocessing
+import os
+import re
+import sys
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+
+from ethos_engine import LEVELS, RATE_MATRIX, calculate_profit_sharing, calculate_rev_share_batch, resolve_title
+
+# One row per sponsor; 'Average Loan Size' is optional and defaults to 445000
+SPONSOR_COLUMNS = ['Name', 'Title'] + [
+    f"{level} {field}" for level in LEVELS for field in ('LO Count', 'Loans per LO')
+]
+SPONSOR_OPTIONAL_COLUMNS = ['Average Loan Size']
+REV_SHARE_COLUMNS = ['name', 'title', 'level', 'lo_count', 'loans_per_lo', 'total_loans', 'volume',
+                     'commissionable_volume', 'bonus_rate', 'gen_bonus', 'rev_share']
+
+
+def _sponsor_rev_share(sponsors, avg_loan_size):
+    missing = [col for col in SPONSOR_COLUMNS if col not in sponsors.columns]
+    if missing:
+        raise ValueError(f"Sponsor file is missing columns: {', '.join(missing)}")
+
+    titles = []
+    errors = []
+    for title in sponsors['Title']:
+        try:
+            titles.append(resolve_title(title))
+            errors.append(None)
+        except ValueError:
+            titles.append(None)
+            errors.append(f"Unknown title: {title}")
+    # Unknown titles are evaluated against row 0 and reported as failures by the callers
+    title_codes = np.array([RATE_MATRIX['title_codes'][title] if title else 0 for title in titles], dtype=np.intp)
+
+    def numeric(column):
+        # Blank, non-numeric or negative values are evaluated as 0 and reported like unknown titles
+        values = pd.to_numeric(sponsors[column], errors='coerce').to_numpy(dtype=float)
+        bad = ~np.isfinite(values) | (values < 0)
+        for i in np.flatnonzero(bad):
+            if errors[i] is None:
+                errors[i] = f"Invalid {column}: {sponsors[column].iloc[i]}"
+        return np.where(bad, 0.0, values)
+
+    loan_sizes = (numeric('Average Loan Size') if 'Average Loan Size' in sponsors.columns
+                  else np.full(len(sponsors), float(avg_loan_size)))
+
+    # sponsors x levels arrays, evaluated against the rate matrix in a single call
+    lo_counts = np.column_stack([numeric(f"{level} LO Count") for level in LEVELS])
+    loans_per_lo = np.column_stack([numeric(f"{level} Loans per LO") for level in LEVELS])
+    units = lo_counts * loans_per_lo
+    batch = calculate_rev_share_batch(
+        RATE_MATRIX,
+        title_codes[:, None],
+        np.arange(len(LEVELS))[None, :],
+        units,
+        avg_loan_size=loan_sizes[:, None]
+    )
+    return titles, title_codes, lo_counts, loans_per_lo, units, batch, errors
+
+
+def sponsor_reports(sponsors, avg_loan_size=445000):
+    """Yield create_detailed_pdf_report inputs for every sponsor, with rev share computed in one batch"""
+    titles, title_codes, lo_counts, loans_per_lo, units, batch, errors = _sponsor_rev_share(sponsors, avg_loan_size)
+    profit_sharing = calculate_profit_sharing()
+
+    for i, name in enumerate(sponsors['Name']):
+        if errors[i] is not None:
+            yield {'user_name': str(name), 'error': errors[i]}
+            continue
+        all_results = [{
+            'Level': level,
+            'LO Count': int(lo_counts[i, j]),
+            'Loans per LO': int(loans_per_lo[i, j]),
+            'Total Loans': int(units[i, j]),
+            'Volume': float(batch['volume'][i, j]),
+            'Commissionable Volume': float(batch['commissionable_volume'][i, j]),
+            'Bonus Rate': float(batch['bonus_rate'][i, j]),
+            'Gen Bonus': float(batch['gen_bonus'][i, j]),
+            'Rev Share': float(batch['rev_share'][i, j])
+        } for j, level in enumerate(LEVELS)]
+        has_profit_share = bool(RATE_MATRIX['has_profit_share'][title_codes[i]])
+        yield {
+            'user_name': str(name),
+            'selected_title': titles[i],
+            'all_results': all_results,
+            'total_rev_share': sum(r['Rev Share'] for r in all_results),
+            'has_profit_share': has_profit_share,
+            'profit_sharing': profit_sharing if has_profit_share else 0
+        }
+
+
+def sponsor_rev_share_table(sponsors, avg_loan_size=445000):
+    """Long-format rev share (one row per sponsor and level) plus the sponsors with an unknown title or bad counts
+
+    Returns (results, failures) where failures is a list of {'name', 'error'}.
+    """
+    titles, _, lo_counts, loans_per_lo, units, batch, errors = _sponsor_rev_share(sponsors, avg_loan_size)
+    valid = np.array([error is None for error in errors], dtype=bool)
+    num_levels = len(LEVELS)
+
+    def flat(values):
+        return np.asarray(values)[valid].ravel()
+
+    results = pd.DataFrame({
+        'name': np.repeat(sponsors['Name'].to_numpy()[valid], num_levels),
+        'title': np.repeat(np.array(titles, dtype=object)[valid], num_levels),
+        'level': np.tile(LEVELS, int(valid.sum())),
+        'lo_count': flat(lo_counts),
+        'loans_per_lo': flat(loans_per_lo),
+        'total_loans': flat(units),
+        **{column: flat(np.broadcast_to(batch[column], units.shape)) for column in REV_SHARE_COLUMNS[6:]}
+    })
+    failures = [{'name': str(name), 'error': error} for name, error in zip(sponsors['Name'], errors) if error is not None]
+    return results, failures
+
+
+def _build_statement(report, report_type, selected_sections):
+    from ethos_reports import create_detailed_pdf_report
+
+    # Vector charts only: batch workers never start a headless browser
+    return create_detailed_pdf_report(
+        report['user_name'], report['selected_title'], report['all_results'], report['total_rev_share'],
+        None, report['has_profit_share'], report['profit_sharing'], report_type, selected_sections,
+        chart_backend='reportlab'
+    ).getvalue()
+
+
+def _statement_filename(user_name, used):
+    stem = re.sub(r'[^a-z0-9_.-]', '', user_name.lower().replace(' ', '_')) or 'sponsor'
+    filename = f"revenue_share_{stem}.pdf"
+    suffix = 2
+    while filename in used:
+        filename = f"revenue_share_{stem}_{suffix}.pdf"
+        suffix += 1
+    used.add(filename)
+    return filename
+
+
+def generate_statements_zip(sponsors, zip_path, workers=None, report_type='detailed', selected_sections=None,
+                            max_pending=None, progress=None):
+    """Build one PDF statement per sponsor across a process pool and stream them into a ZIP on disk
+
+    At most `max_pending` PDFs (default 2 per worker) are in flight or
+    buffered at once, so memory stays flat however many sponsors there are.
+    A sponsor whose PDF fails is recorded and skipped; the rest still run.
+    If a worker dies (e.g. out of memory), the sponsors in flight on that pool
+    are recorded as failures and a fresh pool takes the remaining sponsors.
+    `progress(done, total, name, error)` is called after every sponsor.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or workers * 2
+    total = len(sponsors)
+    reports = sponsor_reports(sponsors)
+    used_names = set()
+    failures = []
+    done = 0
+
+    def new_executor():
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+    executor = new_executor()
+    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        pending = {}
+
+        def record(name, error):
+            nonlocal done
+            if error is not None:
+                failures.append({'name': name, 'error': str(error)})
+            done += 1
+            if progress:
+                progress(done, total, name, error)
+
+        def submit_next():
+            nonlocal executor
+            for report in reports:
+                if 'error' in report:
+                    record(report['user_name'], report['error'])
+                    continue
+                try:
+                    future = executor.submit(_build_statement, report, report_type, selected_sections)
+                except BrokenProcessPool:
+                    # Whatever was in flight on the dead pool fails on its own; the rest go to a fresh pool
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    executor = new_executor()
+                    future = executor.submit(_build_statement, report, report_type, selected_sections)
+                pending[future] = report['user_name']
+                return True
+            return False
+
+        try:
+            while len(pending) < max_pending and submit_next():
+                pass
+
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = pending.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        archive.writestr(_statement_filename(name, used_names), future.result())
+                    record(name, error)
+                    submit_next()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        if failures:
+            archive.writestr('failures.csv', pd.DataFrame(failures).to_csv(index=False))
+
+    return {'total': total, 'written': total - len(failures), 'failures': failures}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build one revenue share PDF statement per sponsor into a ZIP")
+    parser.add_argument('sponsors', help="CSV or Parquet file with columns: " + ", ".join(SPONSOR_COLUMNS))
+    parser.add_argument('output', help="Path of the ZIP archive to write")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all CPU cores)")
+    parser.add_argument('--report-type', choices=['detailed', 'simple'], default='detailed')
+    args = parser.parse_args(argv)
+
+    if args.sponsors.lower().endswith('.parquet'):
+        sponsors = pd.read_parquet(args.sponsors)
+    else:
+        sponsors = pd.read_csv(args.sponsors)
+
+    def print_progress(done, total, name, error):
+        if error is not None:
+            print(f"Failed {name}: {error}", file=sys.stderr)
+        if done == total or done % 100 == 0:
+            print(f"{done:,}/{total:,} statements", file=sys.stderr)
+
+    summary = generate_statements_zip(sponsors, args.output, workers=args.workers,
+                                      report_type=args.report_type, progress=print_progress)
+    print(f"Wrote {summary['written']:,} of {summary['total']:,} statements to {args.output}")
+    return 1 if summary['failures'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,314 @@
+import numpy as np
+import pandas as pd
+
+from ethos_engine import RATE_MATRIX, calculate_rev_share_batch, encode_titles, resolve_title
+
+# One row per LO; 'Sponsor ID' is blank for LOs at the top of the organization
+DOWNLINE_COLUMNS = ['LO ID', 'Sponsor ID', 'Annual Units', 'Loan Size']
+DOWNLINE_OPTIONAL_COLUMNS = ['Name', 'Title']
+# Production changes for existing LOs; a blank Annual Units or Loan Size leaves that figure as it was
+DOWNLINE_EDIT_COLUMNS = ['LO ID']
+DOWNLINE_EDIT_OPTIONAL_COLUMNS = ['Annual Units', 'Loan Size']
+
+# Paid-as title requirements, lowest title first. An LO is paid as the highest title whose
+# every requirement it meets: its own annual units, direct recruits with at least one loan,
+# group volume (its own plus everyone below it) and legs holding `leg_title` or above
+TITLE_QUALIFICATIONS = {
+    'Ambassador (AMB)': {'personal_units': 0, 'active_level1': 0, 'group_volume': 0},
+    'Active Ambassador (AAMB)': {'personal_units': 2, 'active_level1': 1, 'group_volume': 0},
+    'Ambassador 2 (AMB2)': {'personal_units': 2, 'active_level1': 3, 'group_volume': 5_000_000},
+    'Ambassador 3 (AMB3)': {'personal_units': 2, 'active_level1': 5, 'group_volume': 15_000_000},
+    'Director 1 (DIR1)': {'personal_units': 2, 'active_level1': 5, 'group_volume': 30_000_000,
+                          'qualified_legs': 2, 'leg_title': 'AMB3'},
+    'Director 2 (DIR2)': {'personal_units': 2, 'active_level1': 5, 'group_volume': 60_000_000,
+                          'qualified_legs': 3, 'leg_title': 'AMB3'},
+    'Director 3 (DIR3)': {'personal_units': 2, 'active_level1': 5, 'group_volume': 100_000_000,
+                          'qualified_legs': 3, 'leg_title': 'DIR1'}
+}
+QUALIFICATION_FIELDS = ['personal_units', 'active_level1', 'group_volume', 'qualified_legs']
+
+
+def _depth_layers(parents):
+    """LO indices grouped by depth, top of the organization first
+
+    Raises ValueError when the sponsor links do not form a tree (a cycle leaves
+    LOs that are never reached from the top).
+    """
+    n = len(parents)
+    has_parent = parents >= 0
+    # Children grouped by sponsor: the LOs sponsored by s are children[starts[s]:starts[s] + counts[s]]
+    children = np.argsort(parents, kind='stable')[n - np.count_nonzero(has_parent):]
+    counts = np.bincount(parents[has_parent], minlength=n)
+    starts = np.cumsum(counts) - counts
+
+    layers = []
+    frontier = np.flatnonzero(~has_parent)
+    reached = 0
+    while frontier.size:
+        layers.append(frontier)
+        reached += frontier.size
+        frontier_counts = counts[frontier]
+        offsets = np.repeat(starts[frontier] - np.cumsum(frontier_counts) + frontier_counts, frontier_counts)
+        frontier = children[offsets + np.arange(offsets.size)]
+    if reached != n:
+        raise ValueError("Sponsor links contain a cycle")
+    return layers
+
+
+def parent_indices(lo_ids, sponsor_ids):
+    """Row index of each LO's sponsor (-1 where the sponsor is blank) from LO ID and Sponsor ID columns"""
+    ids = pd.Index(lo_ids)
+    if not ids.is_unique:
+        raise ValueError("LO IDs must be unique")
+    # Blank sponsors may come through as empty strings rather than nulls
+    sponsor_ids = pd.Series(sponsor_ids).replace('', None)
+    parents = ids.get_indexer(sponsor_ids)
+    unknown = sponsor_ids.notna().to_numpy() & (parents < 0)
+    if unknown.any():
+        raise ValueError(f"Unknown Sponsor ID: {sponsor_ids.to_numpy()[unknown][0]}")
+    return parents
+
+
+def apply_production_edits(downline, lo_ids, edits):
+    """Apply LO ID / Annual Units / Loan Size edit rows in order through Downline.update_production
+
+    `lo_ids` are the LO IDs in the downline's row order. Returns the indices of
+    every sponsor whose level figures changed.
+    """
+    fields = [col for col in DOWNLINE_EDIT_OPTIONAL_COLUMNS if col in edits.columns]
+    if not fields:
+        raise ValueError(f"Edits need at least one of: {', '.join(DOWNLINE_EDIT_OPTIONAL_COLUMNS)}")
+    rows = pd.Index(lo_ids).get_indexer(edits['LO ID'])
+    if (rows < 0).any():
+        raise ValueError(f"Unknown LO ID in edits: {edits['LO ID'].to_numpy()[rows < 0][0]}")
+
+    units = edits['Annual Units'].to_numpy(dtype=float) if 'Annual Units' in fields else np.full(len(rows), np.nan)
+    loan_sizes = edits['Loan Size'].to_numpy(dtype=float) if 'Loan Size' in fields else np.full(len(rows), np.nan)
+    changed = [np.empty(0, dtype=np.intp)]
+    for lo, lo_units, loan_size in zip(rows, units, loan_sizes):
+        changed.append(downline.update_production(lo, None if np.isnan(lo_units) else lo_units,
+                                                  None if np.isnan(loan_size) else loan_size))
+    return np.unique(np.concatenate(changed))
+
+
+def compile_qualification_rules(rules, rate_matrix):
+    """Compile a TITLE_QUALIFICATIONS style dict into per-title threshold arrays in rate matrix title order"""
+    missing = [title for title in rate_matrix['titles'] if title not in rules]
+    if missing:
+        raise ValueError(f"Qualification rules are missing titles: {', '.join(missing)}")
+
+    compiled = {field: np.array([rules[title].get(field, 0) for title in rate_matrix['titles']], dtype=float)
+                for field in QUALIFICATION_FIELDS}
+    # Titles without a leg requirement point at the lowest title, which every leg holds
+    compiled['leg_title'] = np.array([rate_matrix['title_codes'][resolve_title(rules[title]['leg_title'])]
+                                      if rules[title].get('leg_title') else 0
+                                      for title in rate_matrix['titles']], dtype=np.intp)
+    return compiled
+
+
+class Downline:
+    """An organization stored as parent-index arrays, with each LO's own production
+
+    parents[i] is the index of LO i's sponsor, or -1 at the top. The number of
+    rev share levels follows the rate matrix, so a matrix compiled with
+    compile_rate_matrix(rates, num_levels=5) rolls up five levels.
+    """
+
+    def __init__(self, parents, units, loan_sizes, title_codes=None, names=None, rate_matrix=None):
+        self.parents = np.asarray(parents, dtype=np.intp)
+        n = len(self.parents)
+        if ((self.parents < -1) | (self.parents >= n)).any():
+            raise ValueError("Sponsor index out of range")
+        self.units = np.array(np.broadcast_to(np.asarray(units, dtype=float), (n,)))
+        self.loan_sizes = np.array(np.broadcast_to(np.asarray(loan_sizes, dtype=float), (n,)))
+        self.title_codes = None if title_codes is None else np.asarray(title_codes, dtype=np.intp)
+        self.names = names
+        self.rate_matrix = rate_matrix if rate_matrix is not None else RATE_MATRIX
+
+        self.layers = _depth_layers(self.parents)
+        self.depth = np.empty(n, dtype=np.intp)
+        for depth, layer in enumerate(self.layers):
+            self.depth[layer] = depth
+        self.cached_rollup = None
+
+    @classmethod
+    def from_frame(cls, frame, rate_matrix=None):
+        """Build a Downline from LO ID / Sponsor ID / Annual Units / Loan Size rows (plus optional Name, Title)"""
+        missing = [col for col in DOWNLINE_COLUMNS if col not in frame.columns]
+        if missing:
+            raise ValueError(f"Downline file is missing columns: {', '.join(missing)}")
+        rate_matrix = rate_matrix if rate_matrix is not None else RATE_MATRIX
+
+        parents = parent_indices(frame['LO ID'], frame['Sponsor ID'])
+
+        title_codes = None
+        if 'Title' in frame.columns:
+            titles = frame['Title'].map({title: resolve_title(title) for title in frame['Title'].unique()})
+            title_codes = encode_titles(rate_matrix, titles.to_numpy())
+        names = frame['Name'] if 'Name' in frame.columns else frame['LO ID']
+        return cls(parents, frame['Annual Units'].to_numpy(), frame['Loan Size'].to_numpy(), title_codes,
+                   names.to_numpy(), rate_matrix)
+
+    @property
+    def num_levels(self):
+        return self.rate_matrix['bonus_rate'].shape[1]
+
+    @property
+    def volume(self):
+        return self.units * self.loan_sizes
+
+    def rollup(self, units=None, volume=None):
+        """Level 1..num_levels units and volume (and rev share, when titles are set) for every sponsor at once
+
+        Each level is one bincount over the sponsor links: level k + 1 under a
+        sponsor is level k under each of its direct recruits. Passing per-LO
+        `units` and `volume` rolls those up instead of the LOs' own production,
+        without changing the Downline.
+        """
+        n = len(self.parents)
+        has_parent = self.parents >= 0
+        sponsors = self.parents[has_parent]
+        level_units = np.empty((n, self.num_levels))
+        level_volume = np.empty((n, self.num_levels))
+
+        units = self.units if units is None else np.asarray(units, dtype=float)
+        volume = self.volume if volume is None else np.asarray(volume, dtype=float)
+        for k in range(self.num_levels):
+            units = np.bincount(sponsors, weights=units[has_parent], minlength=n)
+            volume = np.bincount(sponsors, weights=volume[has_parent], minlength=n)
+            level_units[:, k] = units
+            level_volume[:, k] = volume
+
+        rollup = {'level_units': level_units, 'level_volume': level_volume}
+        if self.title_codes is not None:
+            rollup['rev_share'] = self._rev_share(self.title_codes[:, None], np.arange(self.num_levels)[None, :],
+                                                  level_units, level_volume)
+            rollup['total_rev_share'] = rollup['rev_share'].sum(axis=1)
+        return rollup
+
+    def qualify(self, rules=None, active_units=1):
+        """Assign every LO its paid-as title from `rules` (default TITLE_QUALIFICATIONS) in one bottom-up pass
+
+        Generations are processed deepest first, each as one vectorised step, so
+        leg requirements see the titles already earned further down. Sets
+        title_codes (dropping any cached rollup) and returns them together with
+        the group volume and active level 1 counts behind them.
+        """
+        rules = compile_qualification_rules(rules if rules is not None else TITLE_QUALIFICATIONS, self.rate_matrix)
+        n = len(self.parents)
+        has_parent = self.parents >= 0
+        active_level1 = np.bincount(self.parents[has_parent], weights=self.units[has_parent] >= active_units,
+                                    minlength=n)
+        leg_titles = np.unique(rules['leg_title'])
+
+        group_volume = self.volume.copy()
+        title_codes = np.zeros(n, dtype=np.intp)
+        highest_below = np.full(n, -1, dtype=np.intp)  # highest title anywhere under each LO
+        qualified_legs = np.zeros((n, len(leg_titles)))
+        for layer in reversed(self.layers):
+            # Leg counts for this generation come from the generation below, which is already final
+            met = ((self.units[layer, None] >= rules['personal_units'])
+                   & (active_level1[layer, None] >= rules['active_level1'])
+                   & (group_volume[layer, None] >= rules['group_volume'])
+                   & (qualified_legs[layer][:, np.searchsorted(leg_titles, rules['leg_title'])]
+                      >= rules['qualified_legs']))
+            # Highest title met; the lowest title when none is
+            highest_met = met.shape[1] - 1 - np.argmax(met[:, ::-1], axis=1)
+            title_codes[layer] = np.where(met.any(axis=1), highest_met, 0)
+
+            sponsors = self.parents[layer]
+            above = sponsors >= 0
+            leg_best = np.maximum(title_codes[layer], highest_below[layer])[above]
+            np.add.at(group_volume, sponsors[above], group_volume[layer][above])
+            np.maximum.at(highest_below, sponsors[above], leg_best)
+            np.add.at(qualified_legs, sponsors[above], leg_best[:, None] >= leg_titles)
+
+        self.title_codes = title_codes
+        self.cached_rollup = None
+        return {'title_codes': title_codes, 'group_volume': group_volume, 'active_level1': active_level1}
+
+    def refresh(self):
+        """Recompute and cache the full rollup; update_production keeps the cache current from then on"""
+        self.cached_rollup = self.rollup()
+        return self.cached_rollup
+
+    def update_production(self, lo, units=None, loan_size=None):
+        """Change one LO's units and/or loan size and patch the cached rollup in place
+
+        Only the sponsors within num_levels above the LO are touched, so an edit
+        costs O(levels) instead of a full rollup. Returns the indices of the
+        sponsors whose level figures changed.
+        """
+        rollup = self.cached_rollup if self.cached_rollup is not None else self.refresh()
+        old_units, old_volume = self.units[lo], self.units[lo] * self.loan_sizes[lo]
+        if units is not None:
+            self.units[lo] = units
+        if loan_size is not None:
+            self.loan_sizes[lo] = loan_size
+
+        sponsors, levels = [], []
+        sponsor = self.parents[lo]
+        while sponsor >= 0 and len(sponsors) < self.num_levels:
+            sponsors.append(sponsor)
+            levels.append(len(levels))
+            sponsor = self.parents[sponsor]
+        sponsors = np.array(sponsors, dtype=np.intp)
+        levels = np.array(levels, dtype=np.intp)
+
+        rollup['level_units'][sponsors, levels] += self.units[lo] - old_units
+        rollup['level_volume'][sponsors, levels] += self.units[lo] * self.loan_sizes[lo] - old_volume
+        if 'rev_share' in rollup:
+            rev_share = self._rev_share(self.title_codes[sponsors], levels, rollup['level_units'][sponsors, levels],
+                                        rollup['level_volume'][sponsors, levels])
+            rollup['total_rev_share'][sponsors] += rev_share - rollup['rev_share'][sponsors, levels]
+            rollup['rev_share'][sponsors, levels] = rev_share
+        return sponsors
+
+    def audit(self, rtol=1e-9, atol=1e-6):
+        """Compare the incrementally maintained rollup against a full recompute
+
+        Returns {'consistent', 'max_difference', 'mismatched'} where mismatched
+        lists the LOs whose cached figures drifted beyond the tolerance.
+        """
+        if self.cached_rollup is None:
+            return {'consistent': True, 'max_difference': 0.0, 'mismatched': np.empty(0, dtype=np.intp)}
+
+        expected = self.rollup()
+        mismatched = np.zeros(len(self.parents), dtype=bool)
+        max_difference = 0.0
+        for key, values in expected.items():
+            cached = self.cached_rollup[key]
+            close = np.isclose(cached, values, rtol=rtol, atol=atol)
+            mismatched |= ~close.reshape(len(mismatched), -1).all(axis=1)
+            max_difference = max(max_difference, float(np.abs(cached - values).max(initial=0.0)))
+        return {'consistent': not mismatched.any(), 'max_difference': max_difference,
+                'mismatched': np.flatnonzero(mismatched)}
+
+    def _rev_share(self, title_codes, level_codes, level_units, level_volume):
+        # Levels mix loan sizes, so each cell is priced at its own average loan size
+        avg_loan_size = np.divide(level_volume, level_units, out=np.zeros_like(level_volume), where=level_units > 0)
+        return calculate_rev_share_batch(self.rate_matrix, title_codes, level_codes, level_units,
+                                         avg_loan_size=avg_loan_size)['rev_share']
+
+    def table(self, rollup=None):
+        """One row per LO with its own production and the rolled-up levels below it"""
+        rollup = rollup if rollup is not None else self.rollup()
+        names = np.asarray(self.names if self.names is not None else np.arange(len(self.parents)), dtype=object)
+        columns = {
+            'name': names,
+            'sponsor': np.where(self.parents >= 0, names[self.parents], None),
+            'depth': self.depth,
+            'units': self.units,
+            'loan_size': self.loan_sizes,
+            'volume': self.volume
+        }
+        if self.title_codes is not None:
+            columns['title'] = np.array(self.rate_matrix['titles'], dtype=object)[self.title_codes]
+        for k in range(self.num_levels):
+            columns[f'level{k + 1}_units'] = rollup['level_units'][:, k]
+            columns[f'level{k + 1}_volume'] = rollup['level_volume'][:, k]
+            if 'rev_share' in rollup:
+                columns[f'level{k + 1}_rev_share'] = rollup['rev_share'][:, k]
+        if 'total_rev_share' in rollup:
+            columns['rev_share'] = rollup['total_rev_share']
+        return pd.DataFrame(columns)
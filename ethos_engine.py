@@ -0,0 +1,640 @@
+import functools
+import math
+
+# Public API shared by the Streamlit apps, batch jobs and workers. Importing this
+# module pulls in nothing heavy: numpy and pandas load on first use of the
+# vectorised helpers, and Streamlit, plotly and reportlab are never imported.
+__all__ = [
+    'TITLE_BONUS_RATES', 'LEVELS', 'MONTHS', 'COMMISSIONABLE_SHARE', 'RATE_MATRIX',
+    'resolve_title', 'calculate_compensation', 'create_monthly_projection', 'calculate_rev_share',
+    'calculate_profit_sharing', 'calculate_team_compensation', 'calculate_team_thresholds',
+    'calculate_monthly_statements', 'calculate_loan_ledger', 'compile_rate_matrix', 'encode_titles', 'encode_levels',
+    'calculate_rev_share_batch', 'LEVEL_MIXES', 'plan_target_income', 'sensitivity_grid', 'simulate_monthly_income'
+]
+
+TITLE_BONUS_RATES = {
+    'Ambassador (AMB)': {
+        'level1_bonus': 0.0005,
+        'level2_bonus': 0,
+        'level3_bonus': 0,
+        'level1_gen_bonus': 0,
+        'level2_gen_bonus': 0,
+        'level3_gen_bonus': 0,
+        'has_profit_share': False,
+        'profit_share_bonus': 0
+    },
+    'Active Ambassador (AAMB)': {
+        'level1_bonus': 0.001,
+        'level2_bonus': 0,
+        'level3_bonus': 0,
+        'level1_gen_bonus': 0,
+        'level2_gen_bonus': 0,
+        'level3_gen_bonus': 0,
+        'has_profit_share': False,
+        'profit_share_bonus': 0
+    },
+    'Ambassador 2 (AMB2)': {
+        'level1_bonus': 0.001,
+        'level2_bonus': 0.0005,
+        'level3_bonus': 0,
+        'level1_gen_bonus': 0,
+        'level2_gen_bonus': 0,
+        'level3_gen_bonus': 0,
+        'has_profit_share': False,
+        'profit_share_bonus': 0
+    },
+    'Ambassador 3 (AMB3)': {
+        'level1_bonus': 0.001,
+        'level2_bonus': 0.0007,
+        'level3_bonus': 0.0005,
+        'level1_gen_bonus': 0,
+        'level2_gen_bonus': 0,
+        'level3_gen_bonus': 0,
+        'has_profit_share': False,
+        'profit_share_bonus': 0
+    },
+    'Director 1 (DIR1)': {
+        'level1_bonus': 0.001,
+        'level2_bonus': 0.001,
+        'level3_bonus': 0.0007,
+        'level1_gen_bonus': 0.0001,
+        'level2_gen_bonus': 0,
+        'level3_gen_bonus': 0,
+        'has_profit_share': False,
+        'profit_share_bonus': 0
+    },
+    'Director 2 (DIR2)': {
+        'level1_bonus': 0.001,
+        'level2_bonus': 0.001,
+        'level3_bonus': 0.0007,
+        'level1_gen_bonus': 0.0001,
+        'level2_gen_bonus': 0.0001,
+        'level3_gen_bonus': 0,
+        'has_profit_share': False,
+        'profit_share_bonus': 0
+    },
+    'Director 3 (DIR3)': {
+        'level1_bonus': 0.001,
+        'level2_bonus': 0.001,
+        'level3_bonus': 0.0007,
+        'level1_gen_bonus': 0.0001,
+        'level2_gen_bonus': 0.0001,
+        'level3_gen_bonus': 0.0001,
+        'has_profit_share': True,
+        'profit_share_bonus': 0.0001
+    }
+}
+
+LEVELS = ['Level 1', 'Level 2', 'Level 3']
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+COMMISSIONABLE_SHARE = 0.80  # 80% of volume is commissionable
+
+
+def resolve_title(title):
+    """Accept either the full title ('Director 3 (DIR3)') or its code ('DIR3')"""
+    if title in TITLE_BONUS_RATES:
+        return title
+    for full_title in TITLE_BONUS_RATES:
+        if full_title.endswith(f"({str(title).strip().upper()})"):
+            return full_title
+    raise ValueError(f"Unknown title: {title}")
+
+
+def calculate_compensation(loan_amount, interest_rate, rebate, upline_contribution, transaction_fee, annual_units):
+    """Net compensation per loan and per year; returns (net_comp, annual_comp)"""
+    net_comp = loan_amount * (rebate/100) * (1 - upline_contribution/100) - transaction_fee
+    annual_comp = net_comp * annual_units
+    return net_comp, annual_comp
+
+
+def create_monthly_projection(annual_units, net_comp_per_loan):
+    """Month by month income and cumulative income as a DataFrame"""
+    import pandas as pd
+
+    monthly_units = annual_units / 12
+    monthly_data = []
+    cumulative_income = 0
+
+    for month in MONTHS:
+        income = monthly_units * net_comp_per_loan
+        cumulative_income += income
+        monthly_data.append({
+            'Month': month,
+            'Monthly Income': income,
+            'Cumulative Income': cumulative_income
+        })
+
+    return pd.DataFrame(monthly_data)
+
+
+def calculate_rev_share(title, level, units, avg_loan_size=445000):
+    """Revenue share for one title and level; the scalar reference for calculate_rev_share_batch"""
+    rates = TITLE_BONUS_RATES[title]
+    volume = units * avg_loan_size
+    commissionable_volume = volume * COMMISSIONABLE_SHARE
+
+    # Get base bonus rate and generational bonus for the specific level
+    if level == 'Level 1':
+        bonus_rate = rates['level1_bonus']
+        gen_bonus = rates['level1_gen_bonus']
+    elif level == 'Level 2':
+        bonus_rate = rates['level2_bonus']
+        gen_bonus = rates['level2_gen_bonus']
+    else:
+        bonus_rate = rates['level3_bonus']
+        gen_bonus = rates['level3_gen_bonus']
+
+    # Calculate revenue share including both base bonus and generational bonus
+    rev_share = commissionable_volume * (bonus_rate + gen_bonus)
+
+    return {
+        'volume': volume,
+        'commissionable_volume': commissionable_volume,
+        'rev_share': rev_share,
+        'bonus_rate': bonus_rate,
+        'gen_bonus': gen_bonus
+    }
+
+
+def calculate_profit_sharing(company_volume=2136000000):
+    profit_sharing_rate = 0.0001  # 0.01%
+    profit_sharing_share = 0.25   # 25%
+    return company_volume * profit_sharing_rate * profit_sharing_share
+
+
+def calculate_team_compensation(loan_sizes, annual_units, interest_rate, current_rebate, company_split,
+                                current_transaction_fee, ethos_rebate=1.70, ethos_before_upline=0.25,
+                                ethos_after_upline=0.0, ethos_transaction_fee=495, cap_units=20):
+    """Columnar version of calculate_compensation for a whole team in one pass"""
+    import numpy as np
+
+    loan_sizes = np.asarray(loan_sizes, dtype=float)
+    annual_units = np.asarray(annual_units, dtype=float)
+
+    before_cap_units = np.minimum(annual_units, cap_units)
+    after_cap_units = np.maximum(0, annual_units - cap_units)
+
+    # calculate_compensation is pure arithmetic, so it broadcasts over the columns as-is
+    _, current_comp = calculate_compensation(
+        loan_sizes, interest_rate, current_rebate, company_split, current_transaction_fee, annual_units)
+    _, ethos_before_cap = calculate_compensation(
+        loan_sizes, interest_rate, ethos_rebate, ethos_before_upline, ethos_transaction_fee, before_cap_units)
+    _, ethos_after_cap = calculate_compensation(
+        loan_sizes, interest_rate, ethos_rebate, ethos_after_upline, ethos_transaction_fee, after_cap_units)
+
+    return {
+        'volume': loan_sizes * annual_units,
+        'currentComp': current_comp,
+        'ethosBeforeCap': ethos_before_cap,
+        'ethosAfterCap': ethos_after_cap,
+        'ethosComp': ethos_before_cap + ethos_after_cap
+    }
+
+
+def calculate_team_thresholds(loan_sizes, annual_units, interest_rate, current_rebate, company_split,
+                              current_transaction_fee, ethos_rebate=1.70, ethos_before_upline=0.25,
+                              ethos_after_upline=0.0, ethos_transaction_fee=495, cap_units=20, cap_volume=10_000_000):
+    """Break-even and cap-crossing thresholds for a whole team in closed form
+
+    breakevenUnits is the annual units beyond which ETHOS pays more than the
+    current lender: 0 when it pays more from the first loan, NaN when it never
+    catches up. unitCapMonth and volumeCapMonth are the months (1-12) in which
+    the member's annual pace first goes past cap_units or cap_volume, or NaN
+    when it doesn't within the year.
+    """
+    import numpy as np
+
+    loan_sizes = np.asarray(loan_sizes, dtype=float)
+    annual_units = np.asarray(annual_units, dtype=float)
+
+    # Net comp per loan on each side of the cap; ETHOS comp is linear in units on either side
+    current_net, _ = calculate_compensation(
+        loan_sizes, interest_rate, current_rebate, company_split, current_transaction_fee, 1)
+    before_net, _ = calculate_compensation(
+        loan_sizes, interest_rate, ethos_rebate, ethos_before_upline, ethos_transaction_fee, 1)
+    after_net, _ = calculate_compensation(
+        loan_sizes, interest_rate, ethos_rebate, ethos_after_upline, ethos_transaction_fee, 1)
+    before_gain = before_net - current_net
+    after_gain = after_net - current_net
+    annual_volume = loan_sizes * annual_units
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Behind at the cap, the after-cap gain per loan has to make up the before-cap deficit
+        catch_up_units = cap_units - before_gain * cap_units / after_gain
+        breakeven_units = np.where(before_gain > 0, 0.0, np.where(after_gain > 0, catch_up_units, np.nan))
+        unit_cap_month = np.where(annual_units > cap_units, np.floor(12 * cap_units / annual_units) + 1, np.nan)
+        volume_cap_month = np.where(annual_volume > cap_volume, np.floor(12 * cap_volume / annual_volume) + 1, np.nan)
+        volume_cap_units = np.where(loan_sizes > 0, cap_volume / loan_sizes, np.nan)
+
+    return {
+        'breakevenUnits': breakeven_units,
+        'breakevenVolume': breakeven_units * loan_sizes,
+        'unitCapVolume': cap_units * loan_sizes,
+        'volumeCapUnits': volume_cap_units,
+        'unitCapMonth': unit_cap_month,
+        'volumeCapMonth': volume_cap_month
+    }
+
+
+def calculate_monthly_statements(monthly_units, monthly_volume, interest_rate, current_rebate, company_split,
+                                 current_transaction_fee, ethos_rebate=1.70, ethos_before_upline=0.25,
+                                 ethos_after_upline=0.0, ethos_transaction_fee=495, cap_units=20, cap_volume=None,
+                                 anniversary_months=0):
+    """Current lender and ETHOS comp for every LO and month of an LOs x months production matrix
+
+    The ETHOS cap accrues by loan count, or by volume when `cap_volume` is given,
+    and resets at each LO's anniversary: `anniversary_months` is the column
+    (per LO, or one for all) where a cap year starts, repeating every 12 months.
+    The month that crosses the cap is split pro rata. Returns LOs x months
+    arrays keyed like calculate_team_compensation.
+    """
+    import numpy as np
+
+    units = np.atleast_2d(np.asarray(monthly_units, dtype=float))
+    volume = np.atleast_2d(np.asarray(monthly_volume, dtype=float))
+    months = np.arange(units.shape[1])
+    anniversaries = np.asarray(anniversary_months, dtype=np.intp).reshape(-1, 1) % len(MONTHS)
+
+    # Cumulative production within each cap year: the running total along the month axis
+    # minus the running total at the end of the previous cap year
+    cap_year_start = np.maximum(anniversaries + (months - anniversaries) // len(MONTHS) * len(MONTHS), 0)
+    cap_year_start = np.broadcast_to(cap_year_start, units.shape)
+    capped = units if cap_volume is None else volume
+    running = np.cumsum(capped, axis=1)
+    before_year = np.where(cap_year_start > 0,
+                           np.take_along_axis(running, np.maximum(cap_year_start - 1, 0), axis=1), 0)
+    prior = running - capped - before_year
+
+    before_capped = np.clip((cap_units if cap_volume is None else cap_volume) - prior, 0, capped)
+    before_share = np.divide(before_capped, capped, out=np.zeros_like(capped), where=capped > 0)
+    before_units = units * before_share
+    before_volume = volume * before_share
+
+    # calculate_compensation summed over each month's loans: rate x volume - fee x loans
+    current_comp = volume * (current_rebate / 100) * (1 - company_split / 100) - units * current_transaction_fee
+    ethos_before_cap = (before_volume * (ethos_rebate / 100) * (1 - ethos_before_upline / 100)
+                        - before_units * ethos_transaction_fee)
+    ethos_after_cap = ((volume - before_volume) * (ethos_rebate / 100) * (1 - ethos_after_upline / 100)
+                       - (units - before_units) * ethos_transaction_fee)
+
+    return {
+        'units': units,
+        'volume': volume,
+        'beforeCapUnits': before_units,
+        'beforeCapVolume': before_volume,
+        'currentComp': current_comp,
+        'ethosBeforeCap': ethos_before_cap,
+        'ethosAfterCap': ethos_after_cap,
+        'ethosComp': ethos_before_cap + ethos_after_cap
+    }
+
+
+def calculate_loan_ledger(lo_codes, close_dates, loan_amounts, interest_rate, current_rebate, company_split,
+                          current_transaction_fee, ethos_rebate=1.70, ethos_before_upline=0.25,
+                          ethos_after_upline=0.0, ethos_transaction_fee=495, cap_units=20, cap_volume=None,
+                          anniversary_months=1):
+    """Exact current lender and ETHOS comp for every loan in a ledger of individual funded loans
+
+    `lo_codes` are non-negative integers identifying each loan's LO. Each LO's
+    loans accrue towards the cap in close date order (ties keep ledger order)
+    within cap years starting on its anniversary month (1-12, per loan or one
+    for all). With a unit cap the first `cap_units` loans of a cap year are
+    before-cap; with `cap_volume` the loan that crosses the cap is split at the
+    exact cent, and its transaction fee pro rata. Returns per-loan arrays in
+    ledger order keyed like calculate_team_compensation.
+    """
+    import numpy as np
+
+    lo_codes = np.asarray(lo_codes, dtype=np.int64)
+    close_days = np.asarray(close_dates, dtype='datetime64[D]')
+    close_months = close_days.astype('datetime64[M]').astype(np.int64)  # months since Jan 1970
+    loan_amounts = np.asarray(loan_amounts, dtype=float)
+    cap_years = (close_months - (np.asarray(anniversary_months) - 1)) // len(MONTHS)
+
+    # Sort once by LO then close date, as one integer key (a stable argsort is about twice as fast
+    # as lexsort); each (LO, cap year) run is then a segment of the sorted ledger
+    days = close_days.astype(np.int64)
+    first_day = days.min(initial=0)
+    order = np.argsort(lo_codes * (days.max(initial=0) - first_day + 1) + (days - first_day), kind='stable')
+    lo_sorted = lo_codes[order]
+    years_sorted = cap_years[order]
+    new_segment = np.ones(len(order), dtype=bool)
+    new_segment[1:] = (lo_sorted[1:] != lo_sorted[:-1]) | (years_sorted[1:] != years_sorted[:-1])
+    positions = np.arange(len(order))
+    segment_start = np.maximum.accumulate(np.where(new_segment, positions, 0))
+
+    if cap_volume is None:
+        before_share = (positions - segment_start < cap_units).astype(float)
+    else:
+        # Running volume in integer cents, so the crossing point is exact however long the ledger
+        cents = np.round(loan_amounts[order] * 100).astype(np.int64)
+        prior = np.cumsum(cents) - cents
+        prior -= prior[segment_start]
+        before_cents = np.clip(round(cap_volume * 100) - prior, 0, cents)
+        before_share = np.divide(before_cents, cents, out=np.zeros(len(order)), where=cents > 0)
+    before_units = np.empty(len(order))
+    before_units[order] = before_share
+    before_volume = loan_amounts * before_units
+
+    current_comp = loan_amounts * (current_rebate / 100) * (1 - company_split / 100) - current_transaction_fee
+    ethos_before_cap = (before_volume * (ethos_rebate / 100) * (1 - ethos_before_upline / 100)
+                        - before_units * ethos_transaction_fee)
+    ethos_after_cap = ((loan_amounts - before_volume) * (ethos_rebate / 100) * (1 - ethos_after_upline / 100)
+                       - (1 - before_units) * ethos_transaction_fee)
+
+    return {
+        'volume': loan_amounts,
+        'beforeCapUnits': before_units,
+        'beforeCapVolume': before_volume,
+        'currentComp': current_comp,
+        'ethosBeforeCap': ethos_before_cap,
+        'ethosAfterCap': ethos_after_cap,
+        'ethosComp': ethos_before_cap + ethos_after_cap
+    }
+
+
+def sensitivity_grid(loan_sizes, annual_units, current_rebates, interest_rate, company_split, current_transaction_fee,
+                     **ethos_params):
+    """ETHOS total minus current lender comp over every loan size x annual units x current rebate combination
+
+    Broadcasts calculate_team_compensation over the three axes, so the ETHOS side
+    is evaluated once per loan size and units pair, not once per cell. Only the
+    additional comp is returned per cell; current comp is ethos_comp minus it.
+    """
+    import numpy as np
+
+    loan_sizes = np.asarray(loan_sizes, dtype=float)
+    annual_units = np.asarray(annual_units, dtype=float)
+    current_rebates = np.asarray(current_rebates, dtype=float)
+
+    comp = calculate_team_compensation(
+        loan_sizes[:, None, None], annual_units[None, :, None], interest_rate,
+        current_rebates[None, None, :], company_split, current_transaction_fee, **ethos_params)
+    return {
+        'loan_sizes': loan_sizes,
+        'annual_units': annual_units,
+        'current_rebates': current_rebates,
+        'ethos_comp': comp['ethosComp'][:, :, 0],
+        'additional_comp': comp['ethosComp'] - comp['currentComp']
+    }
+
+
+def compile_rate_matrix(title_bonus_rates, num_levels=len(LEVELS)):
+    """Compile a TITLE_BONUS_RATES style dict into dense per-title x per-level rate arrays"""
+    import numpy as np
+
+    titles = list(title_bonus_rates.keys())
+    bonus_rate = np.zeros((len(titles), num_levels))
+    gen_bonus = np.zeros((len(titles), num_levels))
+    for i, title in enumerate(titles):
+        rates = title_bonus_rates[title]
+        for level in range(num_levels):
+            bonus_rate[i, level] = rates.get(f'level{level + 1}_bonus', 0)
+            gen_bonus[i, level] = rates.get(f'level{level + 1}_gen_bonus', 0)
+
+    return {
+        'titles': titles,
+        'title_codes': {title: i for i, title in enumerate(titles)},
+        'bonus_rate': bonus_rate,
+        'gen_bonus': gen_bonus,
+        'has_profit_share': np.array([bool(title_bonus_rates[t]['has_profit_share']) for t in titles]),
+        'profit_share_bonus': np.array([title_bonus_rates[t]['profit_share_bonus'] for t in titles], dtype=float)
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def _default_rate_matrix():
+    return compile_rate_matrix(TITLE_BONUS_RATES)
+
+
+# Declared for linters and readers; the value comes from __getattr__ below
+RATE_MATRIX: dict
+
+
+def __getattr__(name):
+    # RATE_MATRIX is compiled once, on first access, and shared by every calculator and batch job
+    if name == 'RATE_MATRIX':
+        return _default_rate_matrix()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def encode_titles(rate_matrix, titles):
+    """Map title names to row codes of a compiled rate matrix"""
+    import numpy as np
+
+    codes = rate_matrix['title_codes']
+    return np.array([codes[title] for title in np.atleast_1d(titles)], dtype=np.intp)
+
+
+def encode_levels(levels):
+    """Map level names to column codes ('Level 1' -> 0, 'Level 2' -> 1, anything else -> 2)"""
+    import numpy as np
+
+    return np.array([0 if level == 'Level 1' else 1 if level == 'Level 2' else 2
+                     for level in np.atleast_1d(levels)], dtype=np.intp)
+
+
+def calculate_rev_share_batch(rate_matrix, title_codes, level_codes, units, avg_loan_size=445000):
+    """Batched calculate_rev_share over arrays of title codes, level codes, units and loan sizes"""
+    import numpy as np
+
+    title_codes = np.asarray(title_codes, dtype=np.intp)
+    level_codes = np.asarray(level_codes, dtype=np.intp)
+
+    volume = np.asarray(units) * np.asarray(avg_loan_size)
+    commissionable_volume = volume * COMMISSIONABLE_SHARE
+
+    # Gather the base and generational rates for every (title, level) pair at once
+    bonus_rate = rate_matrix['bonus_rate'][title_codes, level_codes]
+    gen_bonus = rate_matrix['gen_bonus'][title_codes, level_codes]
+    rev_share = commissionable_volume * (bonus_rate + gen_bonus)
+
+    return {
+        'volume': volume,
+        'commissionable_volume': commissionable_volume,
+        'rev_share': rev_share,
+        'bonus_rate': bonus_rate,
+        'gen_bonus': gen_bonus
+    }
+
+
+# How the planner spreads required loans over the three levels; weights are relative
+LEVEL_MIXES = {
+    'Even split': (1, 1, 1),
+    'Level 1 only': (1, 0, 0),
+    'Level 2 only': (0, 1, 0),
+    'Level 3 only': (0, 0, 1)
+}
+
+
+def plan_target_income(target_income, level_mixes=None, avg_loan_size=445000, loans_per_lo=None,
+                       company_volume=2136000000, rate_matrix=None):
+    """Loans (and LOs) needed per level for every title to reach `target_income`, under each level mix
+
+    Inverts calculate_rev_share over the whole title x level rate matrix at once:
+    profit sharing is taken off the target for titles that have it, and the rest
+    is spread over the levels in each mix's proportions. Returns titles x mixes
+    (x levels) arrays; targets a title cannot reach under a mix are inf.
+    """
+    import numpy as np
+
+    rate_matrix = rate_matrix if rate_matrix is not None else _default_rate_matrix()
+    level_mixes = level_mixes if level_mixes is not None else LEVEL_MIXES
+    mixes = list(level_mixes)
+    weights = np.array([level_mixes[mix] for mix in mixes], dtype=float).reshape(len(mixes), -1)
+    if (weights < 0).any() or not (weights.sum(axis=1) > 0).all():
+        raise ValueError("Each level mix needs non-negative weights with at least one level above zero")
+    weights /= weights.sum(axis=1, keepdims=True)
+
+    profit_sharing = np.where(rate_matrix['has_profit_share'], calculate_profit_sharing(company_volume), 0.0)
+    rev_share_needed = np.maximum(target_income - profit_sharing, 0.0)
+
+    # Rev share earned per loan under each mix, titles x mixes
+    rates = rate_matrix['bonus_rate'] + rate_matrix['gen_bonus']
+    per_loan = avg_loan_size * COMMISSIONABLE_SHARE * (rates @ weights.T)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        total_units = np.where(rev_share_needed[:, None] > 0, rev_share_needed[:, None] / per_loan, 0.0)
+        units = np.where(weights > 0, total_units[:, :, None] * weights, 0.0)
+
+    plan = {
+        'titles': rate_matrix['titles'],
+        'mixes': mixes,
+        'profit_sharing': profit_sharing,
+        'rev_share_needed': rev_share_needed,
+        'units': units,
+        'total_units': total_units,
+        'volume': total_units * avg_loan_size,
+        'reachable': np.isfinite(total_units)
+    }
+    if loans_per_lo is not None:
+        loans_per_lo = np.broadcast_to(np.asarray(loans_per_lo, dtype=float), weights.shape[1:])
+        if not (loans_per_lo > 0).all():
+            raise ValueError("Loans per LO must be greater than zero")
+        plan['lo_count'] = np.ceil(units / loans_per_lo)
+    return plan
+
+
+def _units_table(mean_units, units_dispersion=None, bits=20):
+    """Inverse CDF of the monthly loan count sampled at 2**bits evenly spaced probabilities
+
+    Indexing it with uniform random integers draws Poisson (or negative binomial)
+    counts several times faster than the samplers in numpy.random, with tails
+    below 2**-bits cut off. Returns None when the pmf can't be tabulated: its
+    first term underflows for very large means, or it has not converged after
+    100,000 loans.
+    """
+    import numpy as np
+
+    if units_dispersion:
+        p = units_dispersion / (units_dispersion + mean_units)
+        pmf = [p ** units_dispersion]
+        next_pmf = lambda k: pmf[-1] * (k + units_dispersion - 1) / k * (1 - p)
+    else:
+        pmf = [math.exp(-mean_units)]
+        next_pmf = lambda k: pmf[-1] * mean_units / k
+    total = pmf[0]
+    while total < 1 - 1e-12 and len(pmf) < 100_000:
+        pmf.append(next_pmf(len(pmf)))
+        total += pmf[-1]
+    if pmf[0] == 0 or total < 1 - 1e-9:
+        return None
+
+    quantiles = (np.arange(1 << bits) + 0.5) / (1 << bits)
+    return np.searchsorted(np.cumsum(pmf), quantiles).astype(np.float32)
+
+
+def _units_sampler(mean_units, units_dispersion=None):
+    """Function drawing a float32 matrix of monthly loan counts: `sample(rng, shape)`"""
+    import numpy as np
+
+    units_table = _units_table(mean_units, units_dispersion)
+    if units_table is not None:
+        return lambda rng, shape: units_table[rng.integers(0, len(units_table), size=shape, dtype=np.uint32)]
+    # Out of the table's range, so fall back to numpy's (slower) samplers
+    if units_dispersion:
+        p = units_dispersion / (units_dispersion + mean_units)
+        return lambda rng, shape: rng.negative_binomial(units_dispersion, p, size=shape).astype(np.float32)
+    return lambda rng, shape: rng.poisson(mean_units, size=shape).astype(np.float32)
+
+
+def _simulate_block(rng, paths, sample_units, loan_amount, loan_size_cv, cap_units, cap_volume):
+    import numpy as np
+
+    shape = (len(MONTHS), paths)
+    units = sample_units(rng, shape)
+
+    # Loans are gamma distributed, and a sum of n iid Gamma(k, theta) loans is Gamma(n k, theta),
+    # so each month's volume is a single draw however many loans closed
+    shape_k = 1 / loan_size_cv ** 2 if loan_size_cv > 0 else None
+    if shape_k:
+        volume = rng.standard_gamma(units * np.float32(shape_k), dtype=np.float32) * np.float32(loan_amount / shape_k)
+    else:
+        volume = units * np.float32(loan_amount)
+
+    if cap_volume is None:
+        # Loans closed before this month count towards the cap; only the month that crosses it is split
+        prior_units = np.cumsum(units, axis=0) - units
+        before_units = np.clip(cap_units - prior_units, 0, units)
+        before_volume = np.where(before_units >= units, volume, np.float32(0))
+        crossing = (before_units > 0) & (before_units < units)
+        if shape_k:
+            # The before-cap loans' share of a gamma sum is Beta(j k, (n - j) k)
+            share = rng.beta(before_units[crossing] * shape_k, (units - before_units)[crossing] * shape_k)
+        else:
+            share = before_units[crossing] / units[crossing]
+        before_volume[crossing] = volume[crossing] * share
+    else:
+        prior_volume = np.cumsum(volume, axis=0) - volume
+        before_volume = np.clip(np.float32(cap_volume) - prior_volume, 0, volume)
+        # Fees follow the volume split, as before_cap_units does in the calculator tab
+        before_share = np.divide(before_volume, volume, out=np.zeros_like(volume), where=volume > 0)
+        before_units = units * before_share
+
+    return units, volume, before_units, before_volume
+
+
+def simulate_monthly_income(loan_amount, annual_units, current_rebate, company_split, current_transaction_fee,
+                            ethos_rebate=1.70, ethos_before_upline=0.25, ethos_after_upline=0.0,
+                            ethos_transaction_fee=495, cap_units=20, cap_volume=None, paths=100_000,
+                            units_dispersion=None, loan_size_cv=0.25, percentiles=(10, 50, 90), seed=None,
+                            block_size=250_000):
+    """Monte Carlo cumulative income for the current lender vs ETHOS over a months x paths matrix
+
+    Monthly loan counts are Poisson with mean annual_units / 12, or negative
+    binomial when `units_dispersion` is given (smaller is burstier). Loan sizes
+    are gamma distributed around `loan_amount` with coefficient of variation
+    `loan_size_cv`. The ETHOS cap accrues per path, by loan count (`cap_units`)
+    or by volume when `cap_volume` is given. Returns the cumulative income
+    percentiles per month for both lenders and the share of paths where ETHOS
+    ends the year ahead.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    sample_units = _units_sampler(annual_units / len(MONTHS), units_dispersion)
+    current_rate = np.float32(current_rebate / 100 * (1 - company_split / 100))
+    ethos_before_rate = np.float32(ethos_rebate / 100 * (1 - ethos_before_upline / 100))
+    ethos_after_rate = np.float32(ethos_rebate / 100 * (1 - ethos_after_upline / 100))
+
+    current = np.empty((len(MONTHS), paths), dtype=np.float32)
+    ethos = np.empty((len(MONTHS), paths), dtype=np.float32)
+    # Paths are simulated in blocks so peak memory stays at two months x paths result matrices
+    for start in range(0, paths, block_size):
+        stop = min(start + block_size, paths)
+        units, volume, before_units, before_volume = _simulate_block(
+            rng, stop - start, sample_units, loan_amount, loan_size_cv, cap_units, cap_volume)
+
+        # calculate_compensation summed over each month's loans: rate x volume - fee x loans
+        np.cumsum(volume * current_rate - units * np.float32(current_transaction_fee), axis=0,
+                  out=current[:, start:stop])
+        np.cumsum(before_volume * ethos_before_rate + (volume - before_volume) * ethos_after_rate
+                  - units * np.float32(ethos_transaction_fee), axis=0, out=ethos[:, start:stop])
+
+    return {
+        'months': MONTHS,
+        'percentiles': list(percentiles),
+        'current': np.percentile(current, percentiles, axis=1),
+        'ethos': np.percentile(ethos, percentiles, axis=1),
+        'ethos_ahead': float(np.mean(ethos[-1] > current[-1])),
+        'paths': paths
+    }
@@ -0,0 +1,401 @@
+import csv
+import functools
+import gzip
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+from ethos_engine import (calculate_loan_ledger, calculate_monthly_statements, calculate_team_compensation,
+                          calculate_team_thresholds)
+
+TEAM_COLUMNS = ['Name', 'Loan Size', 'Annual Units']
+RESULT_COLUMNS = ['volume', 'currentComp', 'ethosBeforeCap', 'ethosAfterCap', 'ethosComp']
+THRESHOLD_COLUMNS = ['breakevenUnits', 'breakevenVolume', 'unitCapVolume', 'volumeCapUnits', 'unitCapMonth',
+                     'volumeCapMonth']
+TEAM_RESULT_COLUMNS = ['name', 'loan_size', 'units', 'volume', 'currentComp', 'ethosBeforeCap', 'ethosAfterCap',
+                       'ethosComp'] + THRESHOLD_COLUMNS
+
+TEAM_FILE_TYPES = ['csv', 'gz', 'parquet', 'arrow', 'feather']
+
+# Streaming CSV readers fix each column's type from the first block, so columns that may hold whole numbers early
+# and decimals (or, for IDs, letters) later are read with a fixed type
+CSV_COLUMN_TYPES = {'Name': 'string', 'LO ID': 'string', 'Sponsor ID': 'string', 'Loan Size': 'float64',
+                    'Annual Units': 'float64', 'Volume': 'float64', 'Loan Amount': 'float64',
+                    'Average Loan Size': 'float64'}
+
+# One row per LO and month; 'Anniversary Month' (1-12) starts each LO's cap year and defaults to January
+PRODUCTION_COLUMNS = ['Name', 'Month', 'Units', 'Volume']
+PRODUCTION_OPTIONAL_COLUMNS = ['Anniversary Month']
+# One row per funded loan
+LEDGER_COLUMNS = ['LO ID', 'Close Date', 'Loan Amount']
+LEDGER_OPTIONAL_COLUMNS = ['Anniversary Month']
+LEDGER_RESULT_COLUMNS = ['units', 'volume', 'beforeCapUnits', 'beforeCapVolume', 'currentComp', 'ethosBeforeCap',
+                         'ethosAfterCap', 'ethosComp']
+STATEMENT_COLUMNS = ['name', 'month', 'units', 'volume', 'beforeCapUnits', 'currentComp', 'ethosBeforeCap',
+                     'ethosAfterCap', 'ethosComp']
+
+
+def team_file_format(file_name):
+    """Pick the reader for an upload from its file name: 'csv', 'parquet' or 'arrow'"""
+    extension = os.path.splitext(str(file_name).lower())[1]
+    if extension == '.parquet':
+        return 'parquet'
+    if extension in ('.arrow', '.feather', '.ipc'):
+        return 'arrow'
+    return 'csv'
+
+
+def _detect_compression(source, compression):
+    if compression != 'infer':
+        return compression
+    if isinstance(source, (str, os.PathLike)):
+        return 'gzip' if str(source).endswith('.gz') else None
+    # File-like uploads have no reliable name, so sniff the gzip magic bytes instead
+    position = source.tell()
+    magic = source.read(2)
+    source.seek(position)
+    return 'gzip' if magic == b'\x1f\x8b' else None
+
+
+def _arrow_source(source):
+    import pyarrow as pa
+
+    if hasattr(source, 'getbuffer'):
+        # In-memory uploads are wrapped zero-copy so arrow never calls back into (or closes) the Python file
+        return pa.py_buffer(source.getbuffer())
+    return source
+
+
+def _missing_columns_message(columns):
+    return f"Upload file must contain columns: {', '.join(columns)}"
+
+
+def _select_columns(names, columns, optional_columns):
+    if not all(col in names for col in columns):
+        raise ValueError(_missing_columns_message(columns))
+    return list(columns) + [col for col in optional_columns if col in names]
+
+
+class _PrefixedStream(io.RawIOBase):
+    """Readable file that returns `prefix` and then the rest of `stream`, for a stream whose start was already read"""
+
+    def __init__(self, prefix, stream):
+        self._prefix = prefix
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        if self._prefix:
+            chunk = self._prefix if size is None or size < 0 else self._prefix[:size]
+            self._prefix = self._prefix[len(chunk):]
+            return chunk
+        return self._stream.read() if size is None or size < 0 else self._stream.read(size)
+
+
+def _csv_header(head):
+    first_line = head.split(b'\n', 1)[0].decode('utf-8-sig')
+    return next(csv.reader([first_line]), [])
+
+
+def _read_csv_chunks(source, chunksize, engine, compression, block_size, columns, optional_columns):
+    compression = _detect_compression(source, compression)
+
+    if engine == 'pyarrow':
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
+
+        with pa.input_stream(_arrow_source(source), compression=compression) as stream:
+            # The header decides which optional columns are read, since fixed column types would otherwise turn a
+            # missing optional column into an all-null one
+            head = stream.read(1 << 16)
+            selected = _select_columns(_csv_header(head), columns, optional_columns)
+            try:
+                reader = pacsv.open_csv(
+                    _PrefixedStream(head, stream),
+                    read_options=pacsv.ReadOptions(block_size=block_size),
+                    convert_options=pacsv.ConvertOptions(
+                        include_columns=selected,
+                        # Blank cells are nulls, as with pandas, so e.g. a top-level LO's Sponsor ID is missing, not ''
+                        strings_can_be_null=True,
+                        column_types={col: pa.type_for_alias(CSV_COLUMN_TYPES[col])
+                                      for col in selected if col in CSV_COLUMN_TYPES})
+                )
+            except (KeyError, pa.ArrowInvalid) as e:
+                raise ValueError(_missing_columns_message(columns)) from e
+            for batch in reader:
+                yield batch.to_pandas()
+        return
+
+    wanted = set(columns) | set(optional_columns)
+    # pandas infers types per chunk, so text columns are pinned too; numbers are cast to float downstream
+    text_columns = {col: str for col in wanted if CSV_COLUMN_TYPES.get(col) == 'string'}
+    reader = pd.read_csv(source, usecols=lambda col: col in wanted, chunksize=chunksize, compression=compression,
+                         dtype=text_columns)
+    with reader:
+        for chunk in reader:
+            yield chunk[_select_columns(chunk.columns, columns, optional_columns)]
+
+
+def _read_parquet_chunks(source, chunksize, columns, optional_columns):
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(_arrow_source(source))
+    selected = _select_columns(parquet_file.schema_arrow.names, columns, optional_columns)
+    # Column projection happens in the Parquet reader, so other columns are never decoded
+    for batch in parquet_file.iter_batches(batch_size=chunksize, columns=selected):
+        yield batch.to_pandas()
+
+
+def _read_arrow_chunks(source, columns, optional_columns):
+    import pyarrow as pa
+
+    source = _arrow_source(source)
+    if isinstance(source, (str, os.PathLike)):
+        source = pa.memory_map(str(source))
+    try:
+        reader = pa.ipc.open_file(source)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    except pa.ArrowInvalid:
+        # Not an IPC file (Feather v2); fall back to the IPC streaming format
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        reader = pa.ipc.open_stream(source)
+        batches = reader
+    selected = _select_columns(reader.schema.names, columns, optional_columns)
+    # Batches are zero-copy views of the buffer, so only the selected columns are ever converted
+    for batch in batches:
+        yield batch.select(selected).to_pandas()
+
+
+def read_table_chunks(source, columns, optional_columns=(), chunksize=100_000, engine='pandas', compression='infer',
+                      block_size=16 << 20, file_format='csv'):
+    """Yield bounded chunks of `columns` (plus any `optional_columns` the file has) from a CSV, Parquet or Arrow file
+
+    `file_format` is 'csv', 'parquet' or 'arrow' (IPC / Feather v2). For CSVs,
+    `chunksize` is in rows for the pandas engine; the pyarrow engine streams
+    record batches of roughly `block_size` bytes instead.
+    """
+    if file_format == 'parquet':
+        return _read_parquet_chunks(source, chunksize, columns, optional_columns)
+    if file_format == 'arrow':
+        return _read_arrow_chunks(source, columns, optional_columns)
+    return _read_csv_chunks(source, chunksize, engine, compression, block_size, columns, optional_columns)
+
+
+def read_team_chunks(source, chunksize=100_000, engine='pandas', compression='infer', block_size=16 << 20,
+                     file_format='csv'):
+    """Yield bounded chunks of the Name / Loan Size / Annual Units columns of a team file"""
+    return read_table_chunks(source, TEAM_COLUMNS, chunksize=chunksize, engine=engine, compression=compression,
+                             block_size=block_size, file_format=file_format)
+
+
+def team_chunk_results(chunk, interest_rate, current_rebate, company_split, current_transaction_fee,
+                       cap_volume=10_000_000, **ethos_params):
+    """Team results table, with break-even and cap thresholds, for one chunk of Name / Loan Size / Annual Units rows"""
+    # float64 throughout, so chunks that happen to read as integers share one schema with the rest of the file
+    loan_sizes = chunk['Loan Size'].to_numpy(dtype=float)
+    units = chunk['Annual Units'].to_numpy(dtype=float)
+    comp_args = (loan_sizes, units, interest_rate, current_rebate, company_split, current_transaction_fee)
+    return pd.DataFrame({
+        'name': chunk['Name'].to_numpy(),
+        'loan_size': loan_sizes,
+        'units': units,
+        **calculate_team_compensation(*comp_args, **ethos_params),
+        **calculate_team_thresholds(*comp_args, cap_volume=cap_volume, **ethos_params)
+    })
+
+
+def stream_team_compensation(chunks, interest_rate, current_rebate, company_split, current_transaction_fee,
+                             mapper=map, **ethos_params):
+    """Feed team chunks through calculate_team_compensation, yielding each result chunk and running totals
+
+    `mapper` applies the per-chunk calculation; pass an order-preserving
+    parallel map to spread chunks over worker processes.
+    """
+    totals = {'members': 0, **{column: 0.0 for column in RESULT_COLUMNS}}
+    calculate_chunk = functools.partial(team_chunk_results, interest_rate=interest_rate, current_rebate=current_rebate,
+                                        company_split=company_split,
+                                        current_transaction_fee=current_transaction_fee, **ethos_params)
+
+    for results in mapper(calculate_chunk, chunks):
+        totals['members'] += len(results)
+        for column in RESULT_COLUMNS:
+            totals[column] += float(results[column].sum())
+
+        yield results, totals
+
+
+def production_matrix(frame):
+    """Pivot Name / Month / Units / Volume rows into LOs x months matrices spanning the first to last month
+
+    Months without a row count as zero production. Returns the LO names, the
+    months (a monthly PeriodIndex), the units and volume matrices and each
+    LO's anniversary as a column offset for calculate_monthly_statements.
+    """
+    missing = [col for col in PRODUCTION_COLUMNS if col not in frame.columns]
+    if missing:
+        raise ValueError(f"Production file is missing columns: {', '.join(missing)}")
+
+    periods = pd.PeriodIndex(pd.to_datetime(frame['Month']), freq='M')
+    first = periods.min()
+    columns = (periods.year - first.year) * 12 + periods.month - first.month
+    months = pd.period_range(first, periods.max(), freq='M')
+    rows, names = pd.factorize(frame['Name'])
+
+    units = np.zeros((len(names), len(months)))
+    volume = np.zeros((len(names), len(months)))
+    np.add.at(units, (rows, columns), frame['Units'].to_numpy(dtype=float))
+    np.add.at(volume, (rows, columns), frame['Volume'].to_numpy(dtype=float))
+
+    anniversary = np.ones(len(names), dtype=int)
+    if 'Anniversary Month' in frame.columns:
+        # An LO's first row carries its anniversary
+        _, first_rows = np.unique(rows, return_index=True)
+        anniversary = frame['Anniversary Month'].to_numpy()[first_rows].astype(int)
+    return {
+        'names': np.asarray(names),
+        'months': months,
+        'units': units,
+        'volume': volume,
+        'anniversary_months': (anniversary - first.month) % 12
+    }
+
+
+def monthly_statement_table(frame, interest_rate, current_rebate, company_split, current_transaction_fee,
+                            **ethos_params):
+    """Long-format monthly statements (one row per LO and month) for a production file"""
+    production = production_matrix(frame)
+    statements = calculate_monthly_statements(
+        production['units'], production['volume'], interest_rate, current_rebate, company_split,
+        current_transaction_fee, anniversary_months=production['anniversary_months'], **ethos_params)
+    num_names, num_months = production['units'].shape
+    return pd.DataFrame({
+        'name': np.repeat(production['names'], num_months),
+        'month': np.tile(production['months'].astype(str), num_names),
+        **{column: statements[column].ravel() for column in STATEMENT_COLUMNS[2:]}
+    })
+
+
+def loan_ledger_tables(frame, interest_rate, current_rebate, company_split, current_transaction_fee, **ethos_params):
+    """Exact per-loan comp for a ledger of funded loans, rolled up per LO and per LO and month
+
+    Returns {'loans', 'by_lo', 'by_month'} DataFrames; loans stay in ledger order.
+    """
+    missing = [col for col in LEDGER_COLUMNS if col not in frame.columns]
+    if missing:
+        raise ValueError(f"Loan ledger is missing columns: {', '.join(missing)}")
+
+    lo_codes, lo_ids = pd.factorize(frame['LO ID'])
+    lo_ids = np.asarray(lo_ids)
+    close_dates = pd.to_datetime(frame['Close Date']).to_numpy().astype('datetime64[D]')
+    ledger = calculate_loan_ledger(
+        lo_codes, close_dates, frame['Loan Amount'].to_numpy(dtype=float), interest_rate, current_rebate,
+        company_split, current_transaction_fee,
+        anniversary_months=frame['Anniversary Month'].to_numpy() if 'Anniversary Month' in frame.columns else 1,
+        **ethos_params)
+    ledger['units'] = np.ones(len(frame))
+
+    def rollup(group_codes, num_groups):
+        return {column: np.bincount(group_codes, weights=ledger[column], minlength=num_groups)
+                for column in LEDGER_RESULT_COLUMNS}
+
+    by_lo = pd.DataFrame({'lo_id': lo_ids, **rollup(lo_codes, len(lo_ids))})
+    by_lo.insert(3, 'avg_loan_size', by_lo['volume'] / by_lo['units'])
+
+    # LO and month packed into one key, so the groups come out sorted by LO then month
+    months = close_dates.astype('datetime64[M]').astype(np.int64)
+    first_month = months.min(initial=0)
+    num_months = months.max(initial=0) - first_month + 1
+    group_codes, groups = pd.factorize(lo_codes * num_months + (months - first_month), sort=True)
+    by_month = pd.DataFrame({
+        'lo_id': lo_ids[groups // num_months],
+        'month': np.datetime_as_string((first_month + groups % num_months).astype('datetime64[M]'), unit='M'),
+        **rollup(group_codes, len(groups))
+    })
+
+    loans = pd.DataFrame({
+        'lo_id': frame['LO ID'].to_numpy(),
+        'close_date': close_dates,
+        **{column: ledger[column] for column in LEDGER_RESULT_COLUMNS[1:]}
+    })
+    return {'loans': loans, 'by_lo': by_lo, 'by_month': by_month}
+
+
+def _write_csv_chunks(frames, path):
+    opener = gzip.open if str(path).endswith('.gz') else open
+    with opener(path, 'wt', newline='', encoding='utf-8') as f:
+        header = True
+        for frame in frames:
+            frame.to_csv(f, index=False, header=header)
+            header = False
+            yield frame
+
+
+def _write_arrow_chunks(frames, path, file_format):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    schema = None
+    try:
+        for frame in frames:
+            # Every chunk is cast to the first chunk's schema so the file has one consistent schema
+            table = pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+            if writer is None:
+                schema = table.schema
+                writer = pq.ParquetWriter(path, schema) if file_format == 'parquet' else pa.ipc.new_file(path, schema)
+            writer.write_table(table)
+            yield frame
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def write_result_chunks(frames, path, file_format=None):
+    """Write result DataFrames to one CSV, Parquet or Arrow IPC file as they arrive, yielding each once written
+
+    The format follows the file extension unless `file_format` is given; a
+    `.gz` CSV is gzip compressed.
+    """
+    file_format = file_format or team_file_format(path)
+    if file_format == 'csv':
+        return _write_csv_chunks(frames, path)
+    return _write_arrow_chunks(frames, path, file_format)
+
+
+def export_team_results(comp_data, file_format='parquet'):
+    """Serialise the team results table to Parquet or Arrow IPC (Feather v2) bytes"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(comp_data[TEAM_RESULT_COLUMNS], preserve_index=False)
+    sink = pa.BufferOutputStream()
+    if file_format == 'parquet':
+        pq.write_table(table, sink)
+    else:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def team_results_table(comp_data):
+    """Arrow table of the team results in report column order"""
+    import pyarrow as pa
+
+    return pa.Table.from_pandas(comp_data[TEAM_RESULT_COLUMNS], preserve_index=False)
+
+
+def query_team_results(table, name_filter='', sort_by=None, descending=False):
+    """Server-side name filter and sort of a team results Arrow table"""
+    import pyarrow.compute as pc
+
+    if name_filter:
+        names = pc.cast(table['name'], 'string')
+        table = table.filter(pc.fill_null(pc.match_substring(names, name_filter, ignore_case=True), False))
+    if sort_by:
+        table = table.sort_by([(sort_by, 'descending' if descending else 'ascending')])
+    return table
@@ -0,0 +1,412 @@
+import functools
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from cachetools import LRUCache
+
+from ethos_engine import MONTHS
+
+# reportlab, plotly and jinja2 are imported inside the functions that use them, so
+# importing this module stays cheap for sessions that never build a report
+
+CHART_IMAGE_CACHE_BYTES = 64 * 1024 * 1024  # 64 MB of rendered PNGs
+
+# Shared by every session in the server process; evicts least recently used images by total size
+_chart_image_cache = LRUCache(maxsize=CHART_IMAGE_CACHE_BYTES, getsizeof=len)
+_chart_image_lock = threading.Lock()
+
+
+def _warm_renderer():
+    # Runs once per worker process so kaleido's Chromium subprocess is already up for the first real chart
+    import plotly.graph_objects as go
+
+    go.Figure(go.Bar(x=[0], y=[0])).to_image(format='png', width=10, height=10)
+
+
+def _ping():
+    return None
+
+
+def _terminate_executor(executor):
+    # ProcessPoolExecutor has no public way to stop a worker stuck mid-task, so its processes are terminated directly
+    processes = list((executor._processes or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+
+def _render_in_worker(fig_json, width, height, image_format):
+    import plotly.io as pio
+
+    start = time.perf_counter()
+    image_bytes = pio.from_json(fig_json).to_image(format=image_format, width=width, height=height)
+    return image_bytes, time.perf_counter() - start
+
+
+class ChartRenderPool:
+    """Long-lived, pre-warmed kaleido worker processes behind a bounded queue
+
+    Each worker keeps its own kaleido/Chromium process alive, so concurrent
+    reports render in parallel instead of serializing on a single renderer.
+    A render that times out recycles the workers, so a hung kaleido never
+    permanently takes a worker out of the pool.
+    """
+
+    def __init__(self, workers=2, max_queue=16, timeout=30, latency_window=512):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor = self._new_executor()
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._rendered = 0
+        self._rejected = 0
+        self._recycled = 0
+        self._latencies = deque(maxlen=latency_window)
+        self._render_times = deque(maxlen=latency_window)
+
+        # Start (and warm) every worker up front rather than on the first report
+        try:
+            for future in [self._executor.submit(_ping) for _ in range(workers)]:
+                future.result(timeout=timeout)
+        except BaseException:
+            _terminate_executor(self._executor)
+            raise
+
+    def _new_executor(self):
+        # spawn, not fork: the Streamlit server process is multi-threaded
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_warm_renderer
+        )
+
+    def _recycle(self, executor):
+        """Swap in fresh workers after `executor` stalled; the stalled ones are terminated once no caller waits on them"""
+        with self._lock:
+            if self._executor is not executor:
+                return  # another timed-out render already recycled it
+            self._executor = self._new_executor()
+            self._recycled += 1
+            fresh = self._executor
+        for _ in range(self.workers):
+            fresh.submit(_ping)  # start warming the new workers without waiting for them
+        # Renders already submitted to the old workers give up within `timeout`, so it is safe to kill them after that
+        retire = threading.Timer(self.timeout, _terminate_executor, args=(executor,))
+        retire.daemon = True
+        retire.start()
+
+    def render(self, fig_json, width=800, height=400, image_format='png'):
+        """Render a figure's JSON in a worker; raises TimeoutError if the queue is full or the render stalls"""
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._rejected += 1
+            raise TimeoutError("Chart render queue is full")
+        with self._lock:
+            self._in_flight += 1
+            executor = self._executor
+        try:
+            future = executor.submit(_render_in_worker, fig_json, width, height, image_format)
+            try:
+                image_bytes, render_time = future.result(timeout=self.timeout)
+            except TimeoutError:
+                self._recycle(executor)
+                raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+        with self._lock:
+            self._rendered += 1
+            self._latencies.append(time.perf_counter() - start)
+            self._render_times.append(render_time)
+        return image_bytes
+
+    def stats(self):
+        """Queue depth and latency percentiles (milliseconds) over the recent render window"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            render_times = sorted(self._render_times)
+            in_flight = self._in_flight
+            rendered = self._rendered
+            rejected = self._rejected
+            recycled = self._recycled
+
+        def percentile(values, pct):
+            if not values:
+                return 0.0
+            return values[min(len(values) - 1, int(pct / 100 * len(values)))] * 1000
+
+        return {
+            'workers': self.workers,
+            'in_flight': in_flight,
+            'queue_depth': max(0, in_flight - self.workers),
+            'rendered': rendered,
+            'rejected': rejected,
+            'recycled': recycled,
+            'latency_p50_ms': percentile(latencies, 50),
+            'latency_p95_ms': percentile(latencies, 95),
+            'render_p50_ms': percentile(render_times, 50),
+            'render_p95_ms': percentile(render_times, 95)
+        }
+
+    def shutdown(self):
+        with self._lock:
+            executor = self._executor
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+
+def get_chart_render_pool(workers=2, max_queue=16, timeout=30):
+    """Process-wide renderer pool, created and warmed on first use"""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ChartRenderPool(workers=workers, max_queue=max_queue, timeout=timeout)
+        return _render_pool
+
+
+def chart_image_key(fig_json, width, height, image_format='png'):
+    """Content address of a rendered chart: the figure JSON plus the render size and format"""
+    payload = f"{fig_json}|{width}x{height}|{image_format}"
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def render_chart_image(fig, width=800, height=400, image_format='png', pool=None):
+    """Rasterize a Plotly figure, rendering each distinct figure/size only once
+
+    Cache misses are rendered on `pool` when one is given, otherwise in-process.
+    """
+    fig_json = fig.to_json()
+    key = chart_image_key(fig_json, width, height, image_format)
+    with _chart_image_lock:
+        image_bytes = _chart_image_cache.get(key)
+    if image_bytes is not None:
+        return image_bytes
+
+    if pool is not None:
+        image_bytes = pool.render(fig_json, width, height, image_format)
+    else:
+        image_bytes = fig.to_image(format=image_format, width=width, height=height)
+    with _chart_image_lock:
+        try:
+            _chart_image_cache[key] = image_bytes
+        except ValueError:
+            pass  # larger than the whole cache; serve it uncached
+    return image_bytes
+
+
+def clear_chart_image_cache():
+    with _chart_image_lock:
+        _chart_image_cache.clear()
+
+
+def create_rev_share_drawing(all_results, width=432, height=216):
+    """Vector "Revenue Share by Level" bar chart drawn with reportlab.graphics (default 6 x 3 inches)"""
+    from reportlab.graphics.charts.barcharts import VerticalBarChart
+    from reportlab.graphics.shapes import Drawing, String
+    from reportlab.lib import colors
+
+    rev_shares = [float(r['Rev Share']) for r in all_results]
+
+    drawing = Drawing(width, height)
+    drawing.add(String(width / 2, height - 16, 'Revenue Share by Level', textAnchor='middle',
+                       fontName='Helvetica-Bold', fontSize=12))
+
+    chart = VerticalBarChart()
+    chart.x = 70
+    chart.y = 30
+    chart.width = width - 90
+    chart.height = height - 70
+    chart.data = [rev_shares]
+    chart.categoryAxis.categoryNames = [r['Level'] for r in all_results]
+    chart.valueAxis.valueMin = 0
+    if not any(rev_shares):
+        chart.valueAxis.valueMax = 1
+    chart.valueAxis.labelTextFormat = lambda value: f"${int(value):,}"
+    chart.bars[0].fillColor = colors.HexColor('#636efa')  # Plotly's default bar colour
+    chart.barLabelFormat = lambda value: f"${int(value):,}"
+    chart.barLabels.nudge = 7
+    chart.barLabels.fontSize = 9
+    for labels in (chart.categoryAxis.labels, chart.valueAxis.labels, chart.barLabels):
+        labels.fontName = 'Helvetica'
+    drawing.add(chart)
+    return drawing
+
+
+def create_chart_image(fig):
+    """Convert Plotly figure to image bytes for PDF"""
+    from reportlab.lib.units import inch
+    from reportlab.platypus import Image
+
+    try:
+        img_bytes = render_chart_image(fig, width=800, height=400, pool=get_chart_render_pool())
+        return Image(io.BytesIO(img_bytes), width=6*inch, height=3*inch)
+    except Exception as e:
+        print(f"Error creating chart image: {e}")
+        return None
+
+
+def create_detailed_pdf_report(user_name, selected_title, all_results, total_rev_share, chart_fig, 
+                             has_profit_share=False, profit_sharing=0, report_type='detailed', 
+                             selected_sections=None, chart_backend='reportlab'):
+    from reportlab.lib import colors
+    from reportlab.lib.enums import TA_CENTER
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import inch
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=0.5*inch)
+    styles = getSampleStyleSheet()
+    elements = []
+    
+    # Custom styles
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        spaceAfter=30,
+        alignment=TA_CENTER
+    )
+    
+    section_style = ParagraphStyle(
+        'SectionStyle',
+        parent=styles['Heading2'],
+        fontSize=16,
+        spaceBefore=20,
+        spaceAfter=10,
+        textColor=colors.HexColor('#1a237e')
+    )
+    
+    # Title Section
+    elements.append(Paragraph(f"Revenue Share Analysis for {user_name}", title_style))
+    elements.append(Spacer(1, 20))
+    
+    # Executive Summary Section
+    if not selected_sections or 'executive_summary' in selected_sections:
+        elements.append(Paragraph("Executive Summary", section_style))
+        summary_data = [
+            ['Title', selected_title],
+            ['Total Revenue Share', f"${int(total_rev_share):,}"],
+            ['Total Loans', sum(r['Total Loans'] for r in all_results)],
+            ['Total Volume', f"${int(sum(r['Volume'] for r in all_results)):,}"]
+        ]
+        if has_profit_share:
+            summary_data.append(['Profit Sharing', f"${int(profit_sharing):,}"])
+            summary_data.append(['Total Compensation', f"${int(total_rev_share + profit_sharing):,}"])
+            
+        summary_table = Table(summary_data, colWidths=[2.5*inch, 3.5*inch])
+        summary_table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#e3f2fd')),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+            ('FONTSIZE', (0, 0), (-1, -1), 12),
+            ('GRID', (0, 0), (-1, -1), 1, colors.grey),
+            ('PADDING', (0, 0), (-1, -1), 6),
+        ]))
+        elements.append(summary_table)
+        elements.append(Spacer(1, 20))
+    
+    # Revenue Chart Section
+    if report_type == 'detailed' and (not selected_sections or 'revenue_chart' in selected_sections):
+        elements.append(Paragraph("Revenue Distribution by Level", section_style))
+        try:
+            # Native vector chart by default; the Plotly/kaleido image is kept as a fallback
+            if chart_backend == 'reportlab':
+                chart_img = create_rev_share_drawing(all_results, width=6*inch, height=3*inch)
+            else:
+                chart_img = create_chart_image(chart_fig)
+            if chart_img:
+                elements.append(chart_img)
+            elements.append(Spacer(1, 20))
+        except Exception as e:
+            print(f"Error adding chart to PDF: {e}")
+            elements.append(Paragraph("Chart could not be generated", styles['Normal']))
+            elements.append(Spacer(1, 20))
+    
+    # Detailed Breakdown Section
+    if report_type == 'detailed' and (not selected_sections or 'level_breakdown' in selected_sections):
+        elements.append(Paragraph("Detailed Level Breakdown", section_style))
+        for result in all_results:
+            elements.append(Paragraph(f"{result['Level']} Analysis", styles['Heading3']))
+            detail_data = [
+                ['Metric', 'Value'],
+                ['LO Count', str(result['LO Count'])],
+                ['Loans per LO', str(result['Loans per LO'])],
+                ['Total Loans', str(result['Total Loans'])],
+                ['Volume', f"${int(result['Volume']):,}"],
+                ['Commissionable Volume', f"${int(result['Commissionable Volume']):,}"],
+                ['Level Bonus Rate', f"{result['Bonus Rate']*100:.2f}%"],
+                ['Generational Bonus', f"{result['Gen Bonus']*100:.2f}%"],
+                # ['Total Bonus Rate', f"{(result['Bonus Rate'] + result['Gen Bonus'])*100:.2f}%"],
+                ['Revenue Share', f"${int(result['Rev Share']):,}"]
+            ]
+            
+            detail_table = Table(detail_data, colWidths=[2.5*inch, 3.5*inch])
+            detail_table.setStyle(TableStyle([
+                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1a237e')),
+                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+                ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+                ('FONTSIZE', (0, 0), (-1, -1), 12),
+                ('GRID', (0, 0), (-1, -1), 1, colors.grey),
+                ('PADDING', (0, 0), (-1, -1), 6),
+            ]))
+            
+            elements.append(detail_table)
+            elements.append(Spacer(1, 15))
+    
+    doc.build(elements)
+    buffer.seek(0)
+    return buffer
+
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+
+@functools.lru_cache(maxsize=None)
+def get_team_report_template():
+    """Team HTML report template, compiled once per process"""
+    from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+    env = Environment(
+        loader=FileSystemLoader(TEMPLATE_DIR),
+        autoescape=select_autoescape(['html']),
+        auto_reload=False
+    )
+    env.filters['money'] = lambda value: f"${value:,.2f}"
+    # Break-even and cap thresholds are NaN when never reached
+    env.filters['threshold'] = lambda value, fmt='{:,.1f}': 'Never' if value != value else fmt.format(value)
+    env.filters['month'] = lambda value: '-' if value != value else MONTHS[int(value) - 1]
+    return env.get_template('team_report.html')
+
+
+def team_report_stream(comp_data, buffer_size=500):
+    """Stream the team HTML report in chunks of `buffer_size` rendered fragments"""
+    totals = {column: float(comp_data[column].sum()) for column in ('volume', 'currentComp', 'ethosComp')}
+    stream = get_team_report_template().stream(
+        rows=comp_data.itertuples(index=False),
+        totals=totals
+    )
+    stream.enable_buffering(buffer_size)
+    return stream
+
+
+def write_team_report(comp_data, fileobj, encoding='utf-8'):
+    """Render the team HTML report incrementally into a binary file object"""
+    team_report_stream(comp_data).dump(fileobj, encoding=encoding)
+    return fileobj
@@ -0,0 +1,240 @@
+import argparse
+import asyncio
+import json
+import math
+import sys
+import time
+from collections import deque
+
+import numpy as np
+import tornado.web
+
+from ethos_engine import LEVELS, RATE_MATRIX, calculate_rev_share_batch, calculate_team_compensation, resolve_title
+
+# Request fields in calculate_team_compensation's argument order; None marks a required field
+COMPENSATION_FIELDS = {
+    'loan_size': None,
+    'annual_units': None,
+    'interest_rate': 6.75,
+    'current_rebate': 1.0,
+    'company_split': 0.0,
+    'current_transaction_fee': 0.0,
+    'ethos_rebate': 1.70,
+    'ethos_before_upline': 0.25,
+    'ethos_after_upline': 0.0,
+    'ethos_transaction_fee': 495,
+    'cap_units': 20
+}
+REV_SHARE_FIELDS = {'title': None, 'level': None, 'units': None, 'avg_loan_size': 445000}
+
+
+def _number(item, field, default):
+    value = item.get(field, default)
+    if value is None:
+        raise ValueError(f"Missing field: {field}")
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be a number") from None
+    if not math.isfinite(value):
+        raise ValueError(f"{field} must be finite")
+    return value
+
+
+def _check_fields(item, fields):
+    if not isinstance(item, dict):
+        raise ValueError("Each request must be a JSON object")
+    unknown = sorted(set(item) - set(fields))
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+
+
+def parse_compensation(item):
+    """Validate one /compensation request into a row of calculate_team_compensation arguments"""
+    _check_fields(item, COMPENSATION_FIELDS)
+    return tuple(_number(item, field, default) for field, default in COMPENSATION_FIELDS.items())
+
+
+def parse_rev_share(item):
+    """Validate one /revshare request into (title, level, title code, level code, units, avg loan size)"""
+    _check_fields(item, REV_SHARE_FIELDS)
+    if item.get('title') is None:
+        raise ValueError("Missing field: title")
+    if not isinstance(item['title'], str):
+        raise ValueError("title must be a string")
+    title = resolve_title(item['title'])
+    level = item.get('level')
+    # Level numbers must be real ints: 2.0 can't index LEVELS, and true would otherwise count as 1
+    if isinstance(level, int) and not isinstance(level, bool) and 1 <= level <= len(LEVELS):
+        level = LEVELS[level - 1]
+    if not isinstance(level, str) or level not in LEVELS:
+        raise ValueError(f"level must be one of {', '.join(LEVELS)}")
+    return (title, level, RATE_MATRIX['title_codes'][title], LEVELS.index(level),
+            _number(item, 'units', None), _number(item, 'avg_loan_size', REV_SHARE_FIELDS['avg_loan_size']))
+
+
+def evaluate_compensation(rows):
+    """Evaluate a batch of parsed /compensation rows in one calculate_team_compensation call"""
+    comp = calculate_team_compensation(*np.array(rows, dtype=float).T)
+    return [{column: float(values[i]) for column, values in comp.items()} for i in range(len(rows))]
+
+
+def evaluate_rev_share(rows):
+    """Evaluate a batch of parsed /revshare rows in one calculate_rev_share_batch call"""
+    titles, levels, title_codes, level_codes, units, loan_sizes = zip(*rows)
+    batch = calculate_rev_share_batch(RATE_MATRIX, title_codes, level_codes, np.array(units),
+                                      avg_loan_size=np.array(loan_sizes))
+    return [{'title': titles[i], 'level': levels[i], **{column: float(values[i]) for column, values in batch.items()}}
+            for i in range(len(rows))]
+
+
+class MicroBatcher:
+    """Coalesce requests that arrive within `max_delay` seconds into one vectorised evaluation
+
+    Runs on the event loop thread only. A batch is flushed as soon as it holds
+    `max_batch` items, or `max_delay` after its first item arrived.
+    """
+
+    def __init__(self, evaluate, max_batch=512, max_delay=0.002, window=4096):
+        self.evaluate = evaluate
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending = []
+        self._flush_handle = None
+        self._requests = 0
+        self._batches = 0
+        self._batch_sizes = deque(maxlen=window)
+        self._latencies = deque(maxlen=window)
+
+    def submit(self, item):
+        """Queue one parsed item; returns a future for its result"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_delay, self._flush)
+        return future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        self._batches += 1
+        self._batch_sizes.append(len(batch))
+        try:
+            results = self.evaluate([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def record_latency(self, seconds):
+        self._requests += 1
+        self._latencies.append(seconds)
+
+    def stats(self):
+        """Request latency (milliseconds) and batch size percentiles over the recent window"""
+        latencies = sorted(self._latencies)
+        batch_sizes = sorted(self._batch_sizes)
+
+        def percentile(values, pct):
+            if not values:
+                return 0
+            return values[min(len(values) - 1, int(pct / 100 * len(values)))]
+
+        return {
+            'requests': self._requests,
+            'batches': self._batches,
+            'pending': len(self._pending),
+            'latency_p50_ms': percentile(latencies, 50) * 1000,
+            'latency_p99_ms': percentile(latencies, 99) * 1000,
+            'batch_size_mean': sum(batch_sizes) / len(batch_sizes) if batch_sizes else 0.0,
+            'batch_size_p50': percentile(batch_sizes, 50),
+            'batch_size_p99': percentile(batch_sizes, 99),
+            'batch_size_max': batch_sizes[-1] if batch_sizes else 0
+        }
+
+
+class CalculationHandler(tornado.web.RequestHandler):
+    """POST a JSON object (or a list of them); items are evaluated together with other in-flight requests"""
+
+    def initialize(self, batcher, parse):
+        self.batcher = batcher
+        self.parse = parse
+
+    def write_json(self, payload, status=200):
+        self.set_status(status)
+        self.set_header('Content-Type', 'application/json')
+        self.finish(json.dumps(payload))
+
+    async def post(self):
+        start = time.perf_counter()
+        try:
+            payload = json.loads(self.request.body or b'null')
+            items = payload if isinstance(payload, list) else [payload]
+            parsed = [self.parse(item) for item in items]
+        except ValueError as e:
+            self.write_json({'error': str(e)}, status=400)
+            return
+
+        results = await asyncio.gather(*(self.batcher.submit(item) for item in parsed))
+        self.write_json(results if isinstance(payload, list) else results[0])
+        self.batcher.record_latency(time.perf_counter() - start)
+
+
+class StatsHandler(tornado.web.RequestHandler):
+    def initialize(self, batchers):
+        self.batchers = batchers
+
+    def get(self):
+        self.write({name: batcher.stats() for name, batcher in self.batchers.items()})
+
+
+def make_app(max_batch=512, max_delay=0.002):
+    """Tornado application serving /compensation, /revshare and /stats"""
+    batchers = {
+        'compensation': MicroBatcher(evaluate_compensation, max_batch=max_batch, max_delay=max_delay),
+        'revshare': MicroBatcher(evaluate_rev_share, max_batch=max_batch, max_delay=max_delay)
+    }
+    return tornado.web.Application([
+        (r'/compensation', CalculationHandler, {'batcher': batchers['compensation'], 'parse': parse_compensation}),
+        (r'/revshare', CalculationHandler, {'batcher': batchers['revshare'], 'parse': parse_rev_share}),
+        (r'/stats', StatsHandler, {'batchers': batchers})
+    ])
+
+
+async def serve(address, port, max_batch, max_delay):
+    app = make_app(max_batch=max_batch, max_delay=max_delay)
+    app.listen(port, address=address)
+    print(f"Serving ETHOS calculations on http://{address}:{port}", file=sys.stderr)
+    await asyncio.Event().wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="JSON HTTP service for ETHOS compensation and revenue share")
+    parser.add_argument('--address', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8502)
+    parser.add_argument('--max-batch', type=int, default=512, help="Largest coalesced batch (default: 512)")
+    parser.add_argument('--max-delay-ms', type=float, default=2.0,
+                        help="How long the first request of a batch waits for others (default: 2)")
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(serve(args.address, args.port, args.max_batch, args.max_delay_ms / 1000))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+import argparse
+import ast
+import os
+import re
+import subprocess
+import sys
+
+DEFAULT_SCRIPT = 'ethos-cal2.py'
+DEFAULT_BUDGET_MS = 1000
+
+# "import time:  self [us] | cumulative | imported package", nesting shown by indentation
+_IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+
+def script_imports(script_path):
+    """Top-level modules a script imports at module level, in the order it imports them"""
+    with open(script_path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=script_path)
+
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            if name not in modules:
+                modules.append(name)
+    return modules
+
+
+def import_timings(modules, cwd=None):
+    """Import `modules` in order in a fresh interpreter and return [(module, ms)] for each
+
+    Each module is charged for everything it pulls in that was not already
+    loaded by an earlier one, so the timings add up to the total cold-start cost.
+    """
+    code = '\n'.join(f"import {module}" for module in modules)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=cwd,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    # Only unindented lines are imports made directly by the snippet; a dotted module
+    # ('plotly.express') may show up as its parent package followed by the submodule
+    top_level = {}
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match and not match.group(3):
+            top_level[match.group(4)] = int(match.group(2)) / 1000
+
+    timings = []
+    for module in modules:
+        parts = module.split('.')
+        ms = sum(top_level.pop('.'.join(parts[:i + 1]), 0.0) for i in range(len(parts)))
+        timings.append((module, ms))
+    return timings
+
+
+def format_report(timings, budget_ms=None):
+    """Plain-text table of import cost per module, slowest first, with the total"""
+    total = sum(ms for _, ms in timings)
+    width = max([len(module) for module, _ in timings] + [len('Total')])
+    lines = [f"{'Module':<{width}}  {'ms':>8}  {'share':>6}"]
+    for module, ms in sorted(timings, key=lambda item: item[1], reverse=True):
+        share = ms / total * 100 if total else 0
+        lines.append(f"{module:<{width}}  {ms:>8.1f}  {share:>5.1f}%")
+    lines.append(f"{'Total':<{width}}  {total:>8.1f}")
+    if budget_ms is not None:
+        status = 'OK' if total <= budget_ms else 'OVER BUDGET'
+        lines.append(f"Budget {budget_ms:,.0f} ms: {status}")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report the cold-start import cost of each module an app imports")
+    parser.add_argument('script', nargs='?', default=DEFAULT_SCRIPT,
+                        help=f"Streamlit script whose module-level imports are timed (default: {DEFAULT_SCRIPT})")
+    parser.add_argument('--module', action='append', default=None,
+                        help="Time these modules instead of the script's imports (repeatable)")
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help=f"Exit non-zero when the total exceeds this (default: {DEFAULT_BUDGET_MS})")
+    args = parser.parse_args(argv)
+
+    script_dir = os.path.dirname(os.path.abspath(args.script))
+    modules = args.module or script_imports(args.script)
+    timings = import_timings(modules, cwd=script_dir)
+    print(format_report(timings, args.budget_ms))
+    return 0 if sum(ms for _, ms in timings) <= args.budget_ms else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,314 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from ethos_downline import Downline, parent_indices
+from ethos_engine import LEVELS
+from ethos_io import LEDGER_COLUMNS
+
+MANIFEST = 'manifest.json'
+# Files replaced by a newer version are deleted only after this long, so a reader that was mid-query on the old
+# manifest can still open them
+RETAIN_SECONDS = 3600
+
+
+def _month_numbers(dates):
+    """Months since January 1970 for an array of dates or 'YYYY-MM' strings"""
+    return np.asarray(pd.to_datetime(dates).to_numpy(), dtype='datetime64[M]').astype(np.int64)
+
+
+def month_label(month_number):
+    """'YYYY-MM' for a month number from the store"""
+    return str(np.datetime64(int(month_number), 'M'))
+
+
+class LoanStore:
+    """Append-only local store of funded loans, kept as memory-mapped Arrow IPC segments
+
+    Every append writes one new loan segment and folds just those loans into
+    per-LO, per-month units and volume aggregates, so team and level queries
+    read the aggregates and never rescan the loans. The manifest is replaced
+    atomically after the data files are written, so it is the commit point of
+    each append; files it does not list are ignored. Every query re-reads the
+    manifest first, so appends from other processes (e.g. a nightly
+    `ethoscalc store`) show up in long-lived instances.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.manifest = {'version': 0, 'segments': [], 'rows': 0, 'aggregates': None, 'downline': None,
+                         'retired': []}
+        # LOs x months production matrices, built from the aggregates on first use and patched on append
+        self._production = None
+        self._downline = None
+        # One instance is shared by every app session, so cache rebuilds are serialised
+        self._lock = threading.RLock()
+        self.refresh()
+
+    def refresh(self):
+        """Pick up the latest committed manifest, dropping cached matrices if another writer has committed since"""
+        manifest_path = self._file(MANIFEST)
+        if not os.path.exists(manifest_path):
+            return
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        with self._lock:
+            if manifest['version'] != self.manifest['version']:
+                self.manifest = manifest
+                self._production = None
+                self._downline = None
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _write_table(self, name, table):
+        import pyarrow as pa
+
+        temp_path = self._file(name + '.tmp')
+        with pa.ipc.new_file(temp_path, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(temp_path, self._file(name))
+
+    def _read_table(self, name):
+        import pyarrow as pa
+
+        # Memory-mapped, so reading is zero-copy and only touched columns are paged in
+        return pa.ipc.open_file(pa.memory_map(self._file(name))).read_all()
+
+    def _commit(self, manifest, replaced=()):
+        now = time.time()
+        retired = self.manifest.get('retired', []) + [{'file': name, 'retired_at': now} for name in replaced if name]
+        manifest['retired'] = [entry for entry in retired if now - entry['retired_at'] < RETAIN_SECONDS]
+        temp_path = self._file(MANIFEST + '.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(temp_path, self._file(MANIFEST))
+        self.manifest = manifest
+        for entry in retired:
+            if now - entry['retired_at'] >= RETAIN_SECONDS and os.path.exists(self._file(entry['file'])):
+                os.remove(self._file(entry['file']))
+
+    def append(self, frame):
+        """Add a batch of LO ID / Close Date / Loan Amount rows; returns the number of loans appended"""
+        import pyarrow as pa
+
+        missing = [col for col in LEDGER_COLUMNS if col not in frame.columns]
+        if missing:
+            raise ValueError(f"Loan ledger is missing columns: {', '.join(missing)}")
+        if frame.empty:
+            return 0
+        self.refresh()
+
+        close_dates = pd.to_datetime(frame['Close Date']).to_numpy().astype('datetime64[D]')
+        loans = pa.table({
+            'lo_id': frame['LO ID'].to_numpy(),
+            'close_date': close_dates,
+            'loan_amount': frame['Loan Amount'].to_numpy(dtype=float)
+        })
+        if self.manifest['segments']:
+            # Every segment shares the first one's schema, so the loans read back as one table
+            first = pa.ipc.open_file(pa.memory_map(self._file(self.manifest['segments'][0]))).schema
+            try:
+                loans = loans.cast(first)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+                raise ValueError(f"LO IDs must have the same type as the loans already stored: {e}") from None
+
+        # Only the appended loans are grouped; the existing aggregates absorb them with one merge. Both come from the
+        # cast IDs, and everything is computed before any file is written
+        added = pd.DataFrame({
+            'lo_id': loans['lo_id'].to_numpy(),
+            'month': _month_numbers(close_dates),
+            'units': 1.0,
+            'volume': loans['loan_amount'].to_numpy()
+        }).groupby(['lo_id', 'month'], as_index=False, sort=False).sum()
+        aggregates = pd.concat([self._stored_aggregates(), added], ignore_index=True)
+        aggregates = pa.Table.from_pandas(aggregates.groupby(['lo_id', 'month'], as_index=False).sum(),
+                                          preserve_index=False)
+
+        version = self.manifest['version'] + 1
+        segment = f"loans-{version:06d}.arrow"
+        aggregates_file = f"aggregates-{version:06d}.arrow"
+        self._write_table(segment, loans)
+        self._write_table(aggregates_file, aggregates)
+
+        self._commit({
+            **self.manifest,
+            'version': version,
+            'segments': self.manifest['segments'] + [segment],
+            'rows': self.manifest['rows'] + len(frame),
+            'aggregates': aggregates_file
+        }, replaced=[self.manifest['aggregates']])
+        with self._lock:
+            if self._production is not None:
+                self._production = self._add_production(self._production, added)
+        return len(frame)
+
+    def _lo_id_type(self):
+        import pyarrow as pa
+
+        if not self.manifest['segments']:
+            return None
+        return pa.ipc.open_file(pa.memory_map(self._file(self.manifest['segments'][0]))).schema.field('lo_id').type
+
+    def _downline_table(self, frame, lo_id_type=None):
+        import pyarrow as pa
+
+        parent_indices(frame['LO ID'], frame['Sponsor ID'])
+        lo_id_type = lo_id_type or self._lo_id_type()
+        try:
+            # from_pandas turns the blank sponsors of top-level LOs into nulls; both columns take the loans' ID type
+            lo_ids = pa.array(frame['LO ID'], from_pandas=True)
+            lo_ids = lo_ids.cast(lo_id_type) if lo_id_type else lo_ids
+            sponsor_ids = pa.array(frame['Sponsor ID'], from_pandas=True).cast(lo_ids.type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+            raise ValueError(f"Downline IDs must have the same type as the stored LO IDs: {e}") from None
+        return pa.table({'lo_id': lo_ids, 'sponsor_id': sponsor_ids})
+
+    def validate_downline(self, frame, loans=None):
+        """Raise ValueError unless set_downline(frame) would succeed, after appending `loans` when given"""
+        import pyarrow as pa
+
+        lo_id_type = self._lo_id_type()
+        if lo_id_type is None and loans is not None:
+            lo_id_type = pa.array(loans['LO ID'], from_pandas=True).type
+        self._downline_table(frame, lo_id_type)
+
+    def set_downline(self, frame):
+        """Store the genealogy (LO ID and Sponsor ID columns) used for level queries"""
+        self.refresh()
+        table = self._downline_table(frame)  # validate before anything is written
+        version = self.manifest['version'] + 1
+        downline_file = f"downline-{version:06d}.arrow"
+        self._write_table(downline_file, table)
+        self._commit({**self.manifest, 'version': version, 'downline': downline_file},
+                     replaced=[self.manifest['downline']])
+        self._downline = None
+
+    def loans(self, columns=None):
+        """Every stored loan as one Arrow table over the memory-mapped segments"""
+        import pyarrow as pa
+
+        self.refresh()
+        tables = [self._read_table(segment) for segment in self.manifest['segments']]
+        if not tables:
+            return pa.table({'lo_id': pa.array([], pa.string()), 'close_date': pa.array([], pa.date32()),
+                             'loan_amount': pa.array([], pa.float64())})
+        table = pa.concat_tables(tables)
+        return table.select(columns) if columns else table
+
+    def _stored_aggregates(self):
+        if self.manifest['aggregates'] is None:
+            return pd.DataFrame({'lo_id': pd.Series(dtype=object), 'month': pd.Series(dtype=np.int64),
+                                 'units': pd.Series(dtype=float), 'volume': pd.Series(dtype=float)})
+        return self._read_table(self.manifest['aggregates']).to_pandas()
+
+    def aggregates(self):
+        """Per-LO, per-month units, volume and loan_size; `month` is a month number (see month_label)"""
+        self.refresh()
+        aggregates = self._stored_aggregates()
+        # Only the additive columns are stored; the average loan size follows from them
+        return aggregates.assign(loan_size=aggregates['volume'] / aggregates['units'])
+
+    def _add_production(self, production, aggregates):
+        """A new production dict with `aggregates` added; the one passed in is left alone for concurrent readers"""
+        months = aggregates['month'].to_numpy()
+        old_rows, old_months = production['units'].shape
+        first, last = months.min(), months.max()
+        if old_months:
+            first = min(first, production['first'])
+            last = max(last, production['first'] + old_months - 1)
+        new_ids = pd.Index(aggregates['lo_id'].unique()).difference(production['lo_ids'], sort=False)
+        lo_ids = production['lo_ids'].append(new_ids)
+
+        # Copy into matrices sized for the new LOs and months, keeping what is already there
+        offset = production['first'] - first if old_months else 0
+        updated = {'lo_ids': lo_ids, 'first': first}
+        rows = lo_ids.get_indexer(aggregates['lo_id'])
+        for key in ('units', 'volume'):
+            matrix = np.zeros((len(lo_ids), last - first + 1))
+            matrix[:old_rows, offset:offset + old_months] = production[key]
+            np.add.at(matrix, (rows, months - first), aggregates[key].to_numpy())
+            updated[key] = matrix
+        return updated
+
+    def production(self):
+        """LOs x months units and volume matrices: {'lo_ids', 'first' (month number), 'units', 'volume'}"""
+        self.refresh()
+        with self._lock:
+            if self._production is None:
+                production = {'lo_ids': pd.Index([]), 'first': 0, 'units': np.zeros((0, 0)),
+                              'volume': np.zeros((0, 0))}
+                aggregates = self._stored_aggregates()
+                self._production = self._add_production(production, aggregates) if len(aggregates) else production
+            return self._production
+
+    def _window(self, production, months, end):
+        last = production['first'] + production['units'].shape[1] - 1
+        end = last if end is None else _month_numbers([end])[0]
+        start = end - months + 1
+        return slice(max(start - production['first'], 0), max(end - production['first'] + 1, 0))
+
+    def team_summary(self, months=12, end=None):
+        """Name / Loan Size / Annual Units per LO over the `months` months to `end` (default: the latest month)
+
+        Annual Units are annualised from the window; LOs without loans in it are
+        left out. The result is ready for team_chunk_results.
+        """
+        production = self.production()
+        window = self._window(production, months, end)
+        units = production['units'][:, window].sum(axis=1)
+        volume = production['volume'][:, window].sum(axis=1)
+        active = units > 0
+        return pd.DataFrame({
+            'Name': production['lo_ids'][active],
+            'Loan Size': volume[active] / units[active],
+            'Annual Units': units[active] * 12 / months
+        })
+
+    def _load_downline(self):
+        with self._lock:
+            if self._downline is None:
+                genealogy = self._read_table(self.manifest['downline']).to_pandas()
+                parents = parent_indices(genealogy['lo_id'], genealogy['sponsor_id'])
+                # Rolling up one unit per LO gives each sponsor's LO count per level
+                downline = Downline(parents, 1.0, 0.0)
+                self._downline = (pd.Index(genealogy['lo_id']), downline, downline.rollup()['level_units'])
+            return self._downline
+
+    def level_production(self, sponsor_id, months=12, end=None):
+        """LO count, loans and volume at each rev share level below `sponsor_id` over the window
+
+        Needs a genealogy (set_downline). Returns {'lo_count', 'units', 'volume'}
+        arrays with one entry per level.
+        """
+        production = self.production()  # refreshes the manifest first
+        if self.manifest['downline'] is None:
+            raise ValueError("The loan store has no downline; add one with set_downline")
+        ids, downline, lo_counts = self._load_downline()
+        if isinstance(sponsor_id, str) and ids.dtype.kind in 'iu' and sponsor_id.lstrip('-').isdigit():
+            sponsor_id = int(sponsor_id)  # IDs typed into the app arrive as text
+        sponsor = ids.get_indexer([sponsor_id])[0]
+        if sponsor < 0:
+            raise ValueError(f"Unknown LO ID: {sponsor_id}")
+
+        window = self._window(production, months, end)
+        rows = production['lo_ids'].get_indexer(ids)
+        has_loans = rows >= 0
+        # Window production is rolled up from local arrays; the shared Downline itself is never modified
+        units = np.zeros(len(ids))
+        volume = np.zeros(len(ids))
+        units[has_loans] = production['units'][rows[has_loans], window].sum(axis=1)
+        volume[has_loans] = production['volume'][rows[has_loans], window].sum(axis=1)
+
+        rollup = downline.rollup(units, volume)
+        return {
+            'levels': LEVELS[:downline.num_levels],
+            'lo_count': lo_counts[sponsor],
+            'units': rollup['level_units'][sponsor] * 12 / months,
+            'volume': rollup['level_volume'][sponsor] * 12 / months
+        }
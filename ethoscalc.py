@@ -0,0 +1,297 @@
+import argparse
+import functools
+import itertools
+import json
+import multiprocessing
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from ethos_batch import SPONSOR_COLUMNS, SPONSOR_OPTIONAL_COLUMNS, sponsor_rev_share_table
+from ethos_downline import (DOWNLINE_COLUMNS, DOWNLINE_EDIT_COLUMNS, DOWNLINE_EDIT_OPTIONAL_COLUMNS,
+                            DOWNLINE_OPTIONAL_COLUMNS, Downline, apply_production_edits)
+from ethos_engine import TITLE_BONUS_RATES, compile_rate_matrix
+from ethos_io import (LEDGER_COLUMNS, LEDGER_OPTIONAL_COLUMNS, PRODUCTION_COLUMNS, PRODUCTION_OPTIONAL_COLUMNS,
+                      TEAM_COLUMNS, loan_ledger_tables, monthly_statement_table, read_table_chunks, read_team_chunks,
+                      stream_team_compensation, team_file_format, write_result_chunks)
+from ethos_store import LoanStore, month_label
+
+
+def ordered_map(func, items, workers=1, max_pending=None):
+    """map() that spreads items over `workers` processes, yielding results in input order
+
+    At most `max_pending` items (default 2 per worker) are in flight at once,
+    so chunks are read from disk only as fast as they are processed.
+    """
+    if workers <= 1:
+        yield from map(func, items)
+        return
+
+    max_pending = max_pending or workers * 2
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _read_chunks(args, columns=None, optional_columns=()):
+    file_format = team_file_format(args.input)
+    if columns is None:
+        return read_team_chunks(args.input, chunksize=args.chunksize, engine=args.engine, file_format=file_format)
+    return read_table_chunks(args.input, columns, optional_columns, chunksize=args.chunksize, engine=args.engine,
+                             file_format=file_format)
+
+
+def run_team(args):
+    totals = {}
+
+    def results():
+        for chunk_results, running_totals in stream_team_compensation(
+                _read_chunks(args), args.interest_rate, args.current_rebate, args.company_split, args.current_fee,
+                mapper=functools.partial(ordered_map, workers=args.workers), cap_volume=args.cap_volume,
+                **_ethos_params(args)):
+            totals.update(running_totals)
+            yield chunk_results
+
+    for _ in write_result_chunks(results(), args.output):
+        pass
+
+    print(f"Wrote {totals.get('members', 0):,} team members to {args.output}")
+    if totals:
+        print(f"Total volume ${totals['volume']:,.2f}, current ${totals['currentComp']:,.2f}, "
+              f"ETHOS ${totals['ethosComp']:,.2f}")
+    return 0
+
+
+def _ethos_params(args):
+    return {'ethos_rebate': args.ethos_rebate, 'ethos_before_upline': args.ethos_before_upline,
+            'ethos_after_upline': args.ethos_after_upline, 'ethos_transaction_fee': args.ethos_fee,
+            'cap_units': args.cap_units}
+
+
+def run_statements(args):
+    # Each LO's cap year runs across rows anywhere in the file, so the whole file is pivoted at once
+    frame = pd.concat(_read_chunks(args, PRODUCTION_COLUMNS, PRODUCTION_OPTIONAL_COLUMNS), ignore_index=True)
+    statements = monthly_statement_table(
+        frame, args.interest_rate, args.current_rebate, args.company_split, args.current_fee,
+        cap_volume=args.cap_volume if args.cap_basis == 'volume' else None, **_ethos_params(args))
+
+    for _ in write_result_chunks([statements], args.output):
+        pass
+
+    print(f"Wrote {len(statements):,} monthly statements for {statements['name'].nunique():,} LOs to {args.output}")
+    print(f"Total current ${statements['currentComp'].sum():,.2f}, ETHOS ${statements['ethosComp'].sum():,.2f}")
+    return 0
+
+
+def run_ledger(args):
+    # Loans are ordered per LO across the whole ledger, so it is read in full
+    frame = pd.concat(_read_chunks(args, LEDGER_COLUMNS, LEDGER_OPTIONAL_COLUMNS), ignore_index=True)
+    tables = loan_ledger_tables(
+        frame, args.interest_rate, args.current_rebate, args.company_split, args.current_fee,
+        cap_volume=args.cap_volume if args.cap_basis == 'volume' else None, **_ethos_params(args))
+
+    for path, table in [(args.output, tables['by_lo']), (args.monthly_output, tables['by_month']),
+                        (args.loans_output, tables['loans'])]:
+        if path:
+            for _ in write_result_chunks([table], path):
+                pass
+
+    by_lo = tables['by_lo']
+    print(f"Wrote {len(tables['loans']):,} loans for {len(by_lo):,} LOs to {args.output}")
+    print(f"Total volume ${by_lo['volume'].sum():,.2f}, current ${by_lo['currentComp'].sum():,.2f}, "
+          f"ETHOS ${by_lo['ethosComp'].sum():,.2f}")
+    return 0
+
+
+def run_revshare(args):
+    totals = {'sponsors': 0, 'rev_share': 0.0}
+    failures = []
+
+    def results():
+        calculate = functools.partial(sponsor_rev_share_table, avg_loan_size=args.avg_loan_size)
+        chunks = _read_chunks(args, SPONSOR_COLUMNS, SPONSOR_OPTIONAL_COLUMNS)
+        for chunk_results, chunk_failures in ordered_map(calculate, chunks, workers=args.workers):
+            for failure in chunk_failures:
+                print(f"Skipped {failure['name']}: {failure['error']}", file=sys.stderr)
+            failures.extend(chunk_failures)
+            totals['sponsors'] += chunk_results['name'].nunique()
+            totals['rev_share'] += float(chunk_results['rev_share'].sum())
+            yield chunk_results
+
+    for _ in write_result_chunks(results(), args.output):
+        pass
+
+    print(f"Wrote rev share for {totals['sponsors']:,} sponsors to {args.output} "
+          f"(total ${totals['rev_share']:,.2f}, {len(failures):,} skipped)")
+    return 1 if failures else 0
+
+
+def run_downline(args):
+    # The whole genealogy is needed for the rollup, so chunks are only a bounded way to read it
+    frame = pd.concat(_read_chunks(args, DOWNLINE_COLUMNS, DOWNLINE_OPTIONAL_COLUMNS), ignore_index=True)
+    downline = Downline.from_frame(frame, compile_rate_matrix(TITLE_BONUS_RATES, num_levels=args.levels))
+    qualification = None
+    if args.qualify:
+        rules = None
+        if args.rules:
+            with open(args.rules, encoding='utf-8') as f:
+                rules = json.load(f)
+        qualification = downline.qualify(rules)
+
+    rollup = None
+    drifted = False
+    if args.edits:
+        # Titles stay as read or qualified above; each edit patches only the sponsors above the edited LO
+        downline.refresh()
+        edits = pd.concat(read_table_chunks(args.edits, DOWNLINE_EDIT_COLUMNS, DOWNLINE_EDIT_OPTIONAL_COLUMNS,
+                                            chunksize=args.chunksize, engine=args.engine,
+                                            file_format=team_file_format(args.edits)), ignore_index=True)
+        changed = apply_production_edits(downline, frame['LO ID'], edits)
+        audit = downline.audit()
+        print(f"Applied {len(edits):,} edits, updating {len(changed):,} sponsors; "
+              f"audit max difference {audit['max_difference']:.3g}")
+        if not audit['consistent']:
+            print(f"Incremental rollup drifted for {len(audit['mismatched']):,} LOs; writing the full recompute",
+                  file=sys.stderr)
+            downline.refresh()
+            drifted = True
+        rollup = downline.cached_rollup
+    table = downline.table(rollup)
+    if qualification is not None:
+        table['group_volume'] = qualification['group_volume']
+        table['active_level1'] = qualification['active_level1']
+
+    for _ in write_result_chunks([table], args.output):
+        pass
+
+    print(f"Wrote {len(table):,} LOs ({len(downline.layers):,} generations deep) to {args.output}")
+    if 'rev_share' in table:
+        print(f"Total rev share ${table['rev_share'].sum():,.2f}")
+    return 1 if drifted else 0
+
+
+def run_store(args):
+    store = LoanStore(args.store)
+    loans = _read_chunks(args, LEDGER_COLUMNS) if args.input else iter([])
+    first_chunk = next(loans, None)
+    genealogy = None
+    if args.downline:
+        # The genealogy is checked against the loans' ID type before any loans are committed
+        genealogy = pd.concat(read_table_chunks(args.downline, ['LO ID', 'Sponsor ID'], chunksize=args.chunksize,
+                                                engine=args.engine, file_format=team_file_format(args.downline)),
+                              ignore_index=True)
+        store.validate_downline(genealogy, first_chunk)
+
+    appended = 0
+    # One segment per chunk keeps memory bounded; the aggregates absorb each chunk as it lands
+    for chunk in itertools.chain([first_chunk] if first_chunk is not None else [], loans):
+        appended += store.append(chunk)
+    if genealogy is not None:
+        store.set_downline(genealogy)
+
+    production = store.production()
+    months = production['units'].shape[1]
+    print(f"Appended {appended:,} loans; {args.store} holds {store.manifest['rows']:,} loans "
+          f"for {len(production['lo_ids']):,} LOs in {len(store.manifest['segments']):,} segments")
+    if months:
+        print(f"Months {month_label(production['first'])} to {month_label(production['first'] + months - 1)}"
+              + (", with a downline" if store.manifest['downline'] else ""))
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='ethoscalc', description="Batch team compensation and revenue share runs")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_io_arguments(subparser, columns, workers=True):
+        subparser.add_argument('--input', required=True,
+                               help="CSV (optionally .gz), Parquet or Arrow file with columns: " + ", ".join(columns))
+        subparser.add_argument('--output', required=True,
+                               help="Results file; the format follows the extension (.csv, .csv.gz, .parquet, .arrow)")
+        if workers:
+            subparser.add_argument('--workers', type=int, default=1, help="Worker processes for chunks (default: 1)")
+        subparser.add_argument('--chunksize', type=int, default=100_000, help="Rows per chunk (default: 100000)")
+        subparser.add_argument('--engine', choices=['pandas', 'pyarrow'], default='pandas', help="CSV reader")
+
+    def add_comp_arguments(subparser):
+        subparser.add_argument('--interest-rate', type=float, default=6.75)
+        subparser.add_argument('--current-rebate', type=float, default=1.0, help="Current lender rebate (%%)")
+        subparser.add_argument('--company-split', type=float, default=0.0, help="Current lender company split (%%)")
+        subparser.add_argument('--current-fee', type=float, default=0.0, help="Current lender transaction fee ($)")
+        subparser.add_argument('--ethos-rebate', type=float, default=1.70)
+        subparser.add_argument('--ethos-before-upline', type=float, default=0.25)
+        subparser.add_argument('--ethos-after-upline', type=float, default=0.0)
+        subparser.add_argument('--ethos-fee', type=float, default=495)
+        subparser.add_argument('--cap-units', type=int, default=20)
+        subparser.add_argument('--cap-volume', type=float, default=10_000_000)
+
+    team = subparsers.add_parser('team', help="ETHOS vs current lender compensation for a team roster")
+    add_io_arguments(team, TEAM_COLUMNS)
+    add_comp_arguments(team)
+    team.set_defaults(run=run_team)
+
+    statements = subparsers.add_parser('statements', help="Monthly ETHOS vs current lender statements per LO")
+    add_io_arguments(statements, PRODUCTION_COLUMNS + [f"{col} (optional)" for col in PRODUCTION_OPTIONAL_COLUMNS],
+                     workers=False)
+    add_comp_arguments(statements)
+    statements.add_argument('--cap-basis', choices=['units', 'volume'], default='units',
+                            help="Whether the ETHOS cap counts loans (--cap-units) or volume (--cap-volume)")
+    statements.set_defaults(run=run_statements)
+
+    ledger = subparsers.add_parser('ledger', help="Exact per-loan ETHOS vs current lender pay from a loan ledger")
+    add_io_arguments(ledger, LEDGER_COLUMNS + [f"{col} (optional)" for col in LEDGER_OPTIONAL_COLUMNS],
+                     workers=False)
+    add_comp_arguments(ledger)
+    ledger.add_argument('--cap-basis', choices=['units', 'volume'], default='units',
+                        help="Whether the ETHOS cap counts loans (--cap-units) or volume (--cap-volume)")
+    ledger.add_argument('--monthly-output', help="Also write the per LO and month rollup here")
+    ledger.add_argument('--loans-output', help="Also write the per-loan results here")
+    ledger.set_defaults(run=run_ledger)
+
+    revshare = subparsers.add_parser('revshare', help="Revenue share per sponsor and level")
+    add_io_arguments(revshare, SPONSOR_COLUMNS + [f"{col} (optional)" for col in SPONSOR_OPTIONAL_COLUMNS])
+    revshare.add_argument('--avg-loan-size', type=float, default=445000,
+                          help="Used when the file has no Average Loan Size column (default: 445000)")
+    revshare.set_defaults(run=run_revshare)
+
+    downline = subparsers.add_parser('downline', help="Level volume and rev share for every LO in a genealogy")
+    add_io_arguments(downline, DOWNLINE_COLUMNS + [f"{col} (optional)" for col in DOWNLINE_OPTIONAL_COLUMNS],
+                     workers=False)
+    downline.add_argument('--levels', type=int, default=3,
+                          help="Rev share levels to roll up; levels without rates pay nothing (default: 3)")
+    downline.add_argument('--qualify', action='store_true',
+                          help="Assign paid-as titles from the qualification rules instead of the Title column")
+    downline.add_argument('--rules', help="JSON file of qualification rules (default: TITLE_QUALIFICATIONS)")
+    downline.add_argument('--edits', help="Production changes applied incrementally and then audited, with columns: "
+                          + ", ".join(DOWNLINE_EDIT_COLUMNS + [f"{col} (optional)"
+                                                               for col in DOWNLINE_EDIT_OPTIONAL_COLUMNS]))
+    downline.set_defaults(run=run_downline)
+
+    store = subparsers.add_parser('store', help="Append loans (and a genealogy) to a local loan store")
+    store.add_argument('--store', required=True, help="Loan store directory (created if missing)")
+    store.add_argument('--input', help="Loans to append, with columns: " + ", ".join(LEDGER_COLUMNS))
+    store.add_argument('--downline', help="Genealogy to store, with columns: LO ID, Sponsor ID")
+    store.add_argument('--chunksize', type=int, default=1_000_000, help="Loans per segment (default: 1000000)")
+    store.add_argument('--engine', choices=['pandas', 'pyarrow'], default='pandas', help="CSV reader")
+    store.set_defaults(run=run_store)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.run(args)
+    except (ValueError, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())